@@ -0,0 +1,91 @@
+from __future__ import print_function
+import multiprocessing
+import array
+
+from graph_search import BreadthFirstSearch
+
+# number of queries sent to a worker at a time
+BATCH_CHUNK_SIZE = 256
+
+# graph snapshots of the running find_friends_batch(), set before the worker processes are forked so they inherit them
+# without pickling, version -> CompactGraph
+_snapshots = dict()
+
+# search engines over _snapshots, one per snapshot in each process, version -> BreadthFirstSearch
+_searches = dict()
+
+
+def find_friends_batch(network, queries, workers=None, D=None, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Find the Dth degree networks of many users against graph snapshots, e.g. to re-score a historic stream of
+    purchases, with the searches spread over a pool of worker processes
+    The snapshots (see UserNetwork.snapshot_network()) are read only, so the workers are forked after they are taken
+    and share them copy on write instead of receiving a copy. Queries are grouped by snapshot into chunks, and the
+    results are returned in the order of the queries, as user ids: the workers return user indexes, which are mapped
+    back through network.user_names here
+
+    :param network: UserNetwork, an instance of UserNetwork class, holding the snapshots
+    :param queries: list, (user_id, version) tuples, user_id is a user's id from the log and version is a key of
+        network.snapshots
+    :param workers: int, number of worker processes, default is the number of CPUs, 1 searches in this process
+    :param D: int, degree of the networks, default is network.D
+    :param chunk_size: int, number of queries sent to a worker at a time
+    :return: list, one list per query with the user ids of the friends in user's Dth degree network, empty for users
+        unknown at that version
+    """
+    global _snapshots, _searches
+    if D is None:
+        D = network.D
+
+    # positions and user indexes of the queries, per snapshot
+    groups = dict()
+    for position, (user_id, version) in enumerate(queries):
+        if version not in network.snapshots:
+            raise ValueError('no snapshot of the network at version {}'.format(version))
+        positions, users = groups.setdefault(version, ([], []))
+        positions.append(position)
+        users.append(network.user_ids.get(user_id))
+
+    tasks = []
+    for version, (positions, users) in groups.items():
+        for start in range(0, len(users), chunk_size):
+            tasks.append((positions[start:start + chunk_size], (version, D, users[start:start + chunk_size])))
+
+    user_names = network.user_names
+    results = [None] * len(queries)
+    _snapshots = dict((version, network.snapshots[version]) for version in groups)
+    try:
+        if workers == 1:
+            for positions, args in tasks:
+                for position, friends in zip(positions, find_friends_chunk(*args)):
+                    results[position] = [user_names[friend] for friend in friends]
+        else:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            try:
+                pending = [(positions, pool.apply_async(find_friends_chunk, args)) for positions, args in tasks]
+                for positions, result in pending:
+                    for position, friends in zip(positions, result.get()):
+                        results[position] = [user_names[friend] for friend in friends]
+            finally:
+                pool.terminate()
+    finally:
+        _snapshots = dict()
+        _searches = dict()
+    return results
+
+
+def find_friends_chunk(version, D, users):
+    """
+    Worker function of find_friends_batch(), searches one snapshot inherited from the parent process
+
+    :param version: int, key of the snapshot in _snapshots
+    :param D: int, degree of the networks
+    :param users: list, user indexes, None for unknown users
+    :return: list, one array('i') of user indexes per user
+    """
+    search = _searches.get(version)
+    if search is None:
+        search = _searches[version] = BreadthFirstSearch(_snapshots[version])
+    n_users = len(search.graph)
+    return [array.array('i', search.reachable_users(user, D)) if user is not None and user < n_users
+            else array.array('i') for user in users]
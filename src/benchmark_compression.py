@@ -0,0 +1,108 @@
+from __future__ import print_function
+import argparse
+import tempfile
+import shutil
+import time
+import gzip
+import lzma
+import bz2
+import sys
+import os
+
+from process_log import UserNetwork, COMPRESSED_LOG_EXTENSIONS, ReadAheadReader, get_json_decoder, \
+    open_compressed_log, process_log
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'insight_testsuite', 'tests',
+                                'test_on_sample_set')
+
+
+def compress_file(filename, extension):
+    """
+    Write a compressed copy of a file next to it
+    
+    :param filename: str, file to compress
+    :param extension: str, one of the extensions in COMPRESSED_LOG_EXTENSIONS
+    :return: str, name of the compressed file, None if the codec is not available
+    """
+    codec = COMPRESSED_LOG_EXTENSIONS[extension]
+    compressed_file = filename + extension
+    if codec == 'gzip':
+        f_out = gzip.open(compressed_file, 'wb')
+    elif codec == 'bz2':
+        f_out = bz2.BZ2File(compressed_file, 'wb')
+    elif codec == 'lzma':
+        f_out = lzma.open(compressed_file, 'wb', format=lzma.FORMAT_XZ if extension == '.xz' else lzma.FORMAT_ALONE)
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        f_out = zstandard.ZstdCompressor().stream_writer(open(compressed_file, 'wb'), closefd=True)
+
+    with open(filename, 'rb') as f_in, f_out:
+        shutil.copyfileobj(f_in, f_out)
+    return compressed_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare decompression throughput of the supported codecs on a test '
+                                                 'dataset')
+    parser.add_argument('test_dir', nargs='?', default=DEFAULT_TEST_DIR,
+                        help='test folder with log_input/ and log_output/ (default: test_on_sample_set)')
+    args = parser.parse_args()
+
+    json_loads = get_json_decoder()
+    with open(os.path.join(args.test_dir, 'log_output', 'flagged_purchases.json'), 'r') as f:
+        expected_output = f.read()
+
+    work_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        logs = dict()
+        for name in ['batch_log.json', 'stream_log.json']:
+            logs[name] = os.path.join(work_dir, name)
+            shutil.copy(os.path.join(args.test_dir, 'log_input', name), logs[name])
+
+        for extension in sorted(COMPRESSED_LOG_EXTENSIONS):
+            batch_log_file = compress_file(logs['batch_log.json'], extension)
+            stream_log_file = compress_file(logs['stream_log.json'], extension)
+            if batch_log_file is None:
+                print('{} codec is not installed, skip'.format(COMPRESSED_LOG_EXTENSIONS[extension]))
+                continue
+
+            # decompression alone, through the read ahead thread
+            start_time = time.time()
+            with ReadAheadReader(open_compressed_log(batch_log_file)) as f:
+                for _ in f:
+                    pass
+            decompress_time = time.time() - start_time
+
+            # full pipeline, decompression overlapping with processing
+            network = UserNetwork()
+            start_time = time.time()
+            process_log(batch_log_file, network, json_loads)
+            network.flagged_purchases = []
+            network.do_flag_purchases = True
+            process_log(stream_log_file, network, json_loads)
+            total_time = time.time() - start_time
+
+            results.append((extension, os.path.getsize(batch_log_file), decompress_time, total_time,
+                            '\n'.join(network.flagged_purchases) == expected_output))
+        uncompressed_size = os.path.getsize(logs['batch_log.json'])
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('')
+    print('{:<8} {:>10} {:>16} {:>12} {:>10} {:>10}'.format('codec', 'ratio', 'decompress (s)', 'MB/s',
+                                                            'total (s)', 'identical'))
+    for extension, size, decompress_time, total_time, identical in results:
+        print('{:<8} {:>10.1f} {:>16.3f} {:>12.1f} {:>10.3f} {:>10}'.format(
+            extension, uncompressed_size * 1. / size, decompress_time, uncompressed_size / 1e6 / decompress_time,
+            total_time, str(identical)))
+
+    if not all(r[4] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from __future__ import print_function
+import argparse
+import time
+import sys
+import os
+
+from process_log import UserNetwork, JSON_DECODERS, get_json_decoder, process_log
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'insight_testsuite', 'tests',
+                                'test_on_sample_set')
+
+
+def time_decoding(lines, json_loads, repeat=3):
+    """
+    Time decoding of log lines already loaded in memory, so file I/O does not affect the comparison
+    
+    :param lines: list of bytes, raw log lines
+    :param json_loads: function, json decoder to benchmark
+    :param repeat: int, number of passes, the fastest one is reported
+    :return: float, best time in seconds for decoding all lines once
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.time()
+        for line in lines:
+            try:
+                json_loads(line)
+            except:
+                pass
+        best = min(best, time.time() - start_time)
+    return best
+
+
+def run_end_to_end(test_dir, json_loads):
+    """
+    Run the full batch + stream pipeline with the given decoder
+    
+    :param test_dir: str, directory containing log_input/batch_log.json and log_input/stream_log.json
+    :param json_loads: function, json decoder to use
+    :return: tuple, (elapsed seconds, flagged output as a string)
+    """
+    network = UserNetwork()
+    start_time = time.time()
+    process_log(os.path.join(test_dir, 'log_input', 'batch_log.json'), network, json_loads)
+    network.flagged_purchases = []
+    network.do_flag_purchases = True
+    process_log(os.path.join(test_dir, 'log_input', 'stream_log.json'), network, json_loads)
+    return time.time() - start_time, '\n'.join(network.flagged_purchases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare json decoder backends on a test dataset')
+    parser.add_argument('test_dir', nargs='?', default=DEFAULT_TEST_DIR,
+                        help='test folder with log_input/ and log_output/ (default: test_on_sample_set)')
+    args = parser.parse_args()
+
+    with open(os.path.join(args.test_dir, 'log_input', 'batch_log.json'), 'rb') as f:
+        lines = f.readlines()
+    with open(os.path.join(args.test_dir, 'log_output', 'flagged_purchases.json'), 'r') as f:
+        expected_output = f.read()
+
+    results = []
+    for name in JSON_DECODERS:
+        try:
+            json_loads = get_json_decoder(name)
+        except ValueError:
+            print('{} is not installed, skip'.format(name))
+            continue
+        decode_time = time_decoding(lines, json_loads)
+        total_time, output = run_end_to_end(args.test_dir, json_loads)
+        results.append((name, decode_time, total_time, output == expected_output))
+
+    print('')
+    print('{:<10} {:>12} {:>14} {:>12} {:>10}'.format('decoder', 'decode (s)', 'lines/s', 'total (s)', 'identical'))
+    for name, decode_time, total_time, identical in results:
+        print('{:<10} {:>12.3f} {:>14.0f} {:>12.3f} {:>10}'.format(name, decode_time, len(lines) / decode_time,
+                                                                 total_time, str(identical)))
+
+    if not all(r[3] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+from __future__ import print_function
+import argparse
+import tempfile
+import shutil
+import time
+import json
+import sys
+import os
+
+from process_log import UserNetwork, get_json_decoder, process_log
+
+DEFAULT_TEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'insight_testsuite', 'tests',
+                                'test_on_sample_set')
+
+# (graph store, purchase store, background compactions) compared against the default dict and ring stores
+STORE_CONFIGURATIONS = [('csr', 'ring', True), ('csr', 'ring', False), ('dict', 'log', True), ('csr', 'log', True)]
+
+
+def write_stream_with_params(stream_log_file, output_file, D, T, params_every):
+    """
+    Copy a stream log, inserting a {"D", "T"} entry every params_every lines, so the purchase stores are resized in
+    the middle of the stream; T goes down, up, to 1 and back to its value from the batch log
+
+    :param stream_log_file: str, stream log to copy
+    :param output_file: str, file the copy is written to
+    :param D: int, degree of the networks, unchanged
+    :param T: int, number of purchases from the batch log
+    :param params_every: int, number of lines between two {"D", "T"} entries
+    :return: int, number of {"D", "T"} entries inserted
+    """
+    schedule = [max(T // 5, 1), 2 * T, 1, T]
+    n_params = 0
+    with open(stream_log_file, 'r') as f_in, open(output_file, 'w') as f_out:
+        for i, line in enumerate(f_in):
+            if i and i % params_every == 0:
+                f_out.write(json.dumps({'D': str(D), 'T': str(schedule[n_params % len(schedule)])}) + '\n')
+                n_params += 1
+            f_out.write(line if line.endswith('\n') else line + '\n')
+    return n_params
+
+
+def run_stores(batch_log_file, stream_log_file, json_loads, graph_store, purchase_store, background,
+               compaction_min_rows, compaction_min_entries):
+    """
+    Run the batch + stream pipeline with some graph and purchase stores, the csr graph gets tiny compaction thresholds
+    once batch_log is processed, so its compactions (in a background thread if background) happen while the stream
+    changes the graph, and the purchase log gets a tiny compaction_min_entries from the start
+
+    :param batch_log_file: str, batch log file name
+    :param stream_log_file: str, stream log file name
+    :param json_loads: function, json decoder
+    :param graph_store: str, one of GRAPH_STORES
+    :param purchase_store: str, one of PURCHASE_STORES
+    :param background: bool, whether the csr graph compacts in a background thread
+    :param compaction_min_rows: int, compaction_min_rows of the csr graph during the stream
+    :param compaction_min_entries: int, compaction_min_entries of the purchase log
+    :return: tuple, (elapsed seconds, graph compactions during the stream, UserNetwork after the stream)
+    """
+    network = UserNetwork(graph_store=graph_store, purchase_store=purchase_store)
+    if purchase_store == 'log':
+        network.own_purchases.compaction_min_entries = compaction_min_entries
+    start_time = time.time()
+    process_log(batch_log_file, network, json_loads)
+    network.network.compact()
+    batch_compactions = getattr(network.network, 'n_compactions', 0)
+    if graph_store == 'csr':
+        network.network.compaction_min_rows = compaction_min_rows
+        network.network.compaction_fraction = 0.
+        network.network.background = background
+    network.flagged_purchases = []
+    network.do_flag_purchases = True
+    process_log(stream_log_file, network, json_loads)
+    elapsed = time.time() - start_time
+    network.network.compact()  # install a background compaction still running, its rows are compared too
+    return elapsed, getattr(network.network, 'n_compactions', 0) - batch_compactions - 1, network
+
+
+def same_graph(network, reference):
+    """
+    :param network: UserNetwork, network to check
+    :param reference: UserNetwork, network built from the same logs with the default stores
+    :return: bool, whether every user has the same friends with the same multiplicities in both networks
+    """
+    graph, reference_graph = network.network, reference.network
+    for user in range(len(reference_graph)):
+        row = dict((friend, graph.multiplicity(user, friend)) for friend in graph[user])
+        if row != dict((friend, reference_graph.multiplicity(user, friend)) for friend in reference_graph[user]):
+            return False
+    return len(graph) == len(reference_graph)
+
+
+def same_purchases(network, reference):
+    """
+    :param network: UserNetwork, network to check
+    :param reference: UserNetwork, network built from the same logs with the default stores
+    :return: bool, whether every user has the same purchase history in both networks
+    """
+    purchases, reference_purchases = network.own_purchases, reference.own_purchases
+    return len(purchases) == len(reference_purchases) and all(
+        purchases.history(user) == reference_purchases.history(user) for user in range(len(reference_purchases)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the csr graph and the purchase log flag the same '
+                                                 'purchases as the default stores, with compactions and T changes '
+                                                 'during the stream')
+    parser.add_argument('test_dir', nargs='?', default=DEFAULT_TEST_DIR,
+                        help='test folder with log_input/ (default: test_on_sample_set)')
+    parser.add_argument('--params-every', type=int, default=200,
+                        help='number of stream lines between two inserted {"D", "T"} entries (default: 200)')
+    parser.add_argument('--compaction-min-rows', type=int, default=8,
+                        help='compaction_min_rows of the csr graph during the stream (default: 8)')
+    parser.add_argument('--compaction-min-entries', type=int, default=1024,
+                        help='compaction_min_entries of the purchase log (default: 1024)')
+    args = parser.parse_args()
+
+    json_loads = get_json_decoder()
+    batch_log_file = os.path.join(args.test_dir, 'log_input', 'batch_log.json')
+    with open(batch_log_file, 'rb') as f:
+        params = json_loads(f.readline())
+    D, T = int(params['D']), int(params['T'])
+
+    work_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        stream_log_file = os.path.join(work_dir, 'stream_log.json')
+        n_params = write_stream_with_params(os.path.join(args.test_dir, 'log_input', 'stream_log.json'),
+                                            stream_log_file, D, T, args.params_every)
+        print('{} {{"D", "T"}} entries inserted in stream_log'.format(n_params))
+
+        _, _, reference = run_stores(batch_log_file, stream_log_file, json_loads, 'dict', 'ring', True,
+                                     args.compaction_min_rows, args.compaction_min_entries)
+        for graph_store, purchase_store, background in STORE_CONFIGURATIONS:
+            elapsed, graph_compactions, network = run_stores(
+                batch_log_file, stream_log_file, json_loads, graph_store, purchase_store, background,
+                args.compaction_min_rows, args.compaction_min_entries)
+            results.append((graph_store, purchase_store, background, elapsed, graph_compactions,
+                            getattr(network.own_purchases, 'n_compactions', 0),
+                            network.flagged_purchases == reference.flagged_purchases,
+                            same_graph(network, reference), same_purchases(network, reference)))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('')
+    print('{:<6} {:<6} {:>11} {:>10} {:>20} {:>16} {:>8} {:>8} {:>10}'.format(
+        'graph', 'store', 'background', 'total (s)', 'stream compactions', 'log compactions', 'output', 'graph',
+        'purchases'))
+    for (graph_store, purchase_store, background, elapsed, graph_compactions, log_compactions, same_output,
+         graph_identical, purchases_identical) in results:
+        print('{:<6} {:<6} {:>11} {:>10.3f} {:>20} {:>16} {:>8} {:>8} {:>10}'.format(
+            graph_store, purchase_store, str(background) if graph_store == 'csr' else '-', elapsed,
+            graph_compactions if graph_store == 'csr' else '-', log_compactions if purchase_store == 'log' else '-',
+            str(same_output), str(graph_identical), str(purchases_identical)))
+
+    if not all(all(r[6:]) for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from __future__ import print_function
+import argparse
+
+from process_log import JSON_DECODERS, get_json_decoder, convert_log_to_event_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a json log into a binary event log, which process_log.py '
+                                                 'replays without parsing json again')
+    parser.add_argument('log_file', help='json log, e.g. batch_log.json')
+    parser.add_argument('event_log_file', help='output binary event log')
+    parser.add_argument('--json-decoder', default='auto', choices=['auto'] + JSON_DECODERS,
+                        help='json backend used to parse log lines (default: fastest installed)')
+    args = parser.parse_args()
+
+    convert_log_to_event_log(args.log_file, args.event_log_file, get_json_decoder(args.json_decoder))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import print_function
+
+try:
+    import numpy as np
+except ImportError:  # optional, only for vectorized frontier expansion
+    np = None
+
+# frontiers of at least this many users are expanded with numpy when the graph is a CompactGraph
+VECTORIZED_FRONTIER_SIZE = 512
+
+
+class BreadthFirstSearch(object):
+    def __init__(self, graph, vectorized_frontier_size=VECTORIZED_FRONTIER_SIZE):
+        """
+        Breadth first search over a graph store (see graph_store.py) with user indexes as nodes
+        The visited flags are one reusable bytearray indexed by user index, and only the flags set by a search are reset
+        after it, so a search costs O(number of users reached + their connections) with no per level set copies.
+        When numpy is installed and the graph is a CompactGraph, large frontiers are expanded with vectorized
+        operations over its CSR arrays instead of Python loops, see _expand_vectorized().
+        Not thread safe, one search runs at a time
+
+        :param graph: AdjacencyGraph or CompactGraph, the user network
+        :param vectorized_frontier_size: int, minimum frontier size expanded with numpy, None never uses numpy
+        """
+        self.graph = graph
+        self.visited = bytearray()
+        self.claims = None  # reusable numpy array indexed by user index, see _expand_vectorized()
+        self.vectorized_frontier_size = vectorized_frontier_size
+        if np is None or not hasattr(graph, 'offsets'):
+            self.vectorized_frontier_size = None
+
+    def reachable_users(self, user, depth):
+        """
+        Function to find all the users within depth hops of user, not including user
+
+        :param user: int, user's index
+        :param depth: int, maximum number of hops
+        :return: list, user indexes of the users within depth hops, each once, in order of distance
+        """
+        graph = self.graph
+        visited = self.visited
+        if len(visited) < len(graph):  # grow with the network, doubling to amortize
+            visited.extend(bytes(max(len(graph), 2 * len(visited)) - len(visited)))
+
+        visited[user] = 1
+        reached = []
+        front = [user]
+        vectorized_frontier_size = self.vectorized_frontier_size
+        while depth > 0 and front:
+            if vectorized_frontier_size is not None and len(front) >= vectorized_frontier_size:
+                new_front = self._expand_vectorized(front)
+            else:
+                new_front = []
+                for f in front:
+                    for friend in graph[f]:
+                        if not visited[friend]:
+                            visited[friend] = 1
+                            new_front.append(friend)
+            reached.extend(new_front)
+            front = new_front
+            depth -= 1
+
+        # sparse reset, only the flags set by this search
+        visited[user] = 0
+        if vectorized_frontier_size is not None and len(reached) >= vectorized_frontier_size:
+            np.frombuffer(visited, dtype=np.uint8)[np.array(reached, dtype=np.int64)] = 0
+        else:
+            for friend in reached:
+                visited[friend] = 0
+        return reached
+
+    def _expand_vectorized(self, front):
+        """
+        Find the unvisited friends of a frontier and mark them visited, with numpy
+        The rows of the CSR base are gathered in one indexing operation, the rows in the delta of the CompactGraph
+        (changed since the last compaction) are read from their dicts
+
+        :param front: list, user indexes of the frontier
+        :return: list, user indexes of the unvisited friends of the frontier
+        """
+        graph = self.graph
+        front = np.array(front, dtype=np.int64)
+
+        delta = graph.delta
+        neighbors = []
+        if delta:
+            in_delta = front >= graph.n_base
+            in_delta |= np.isin(front, np.fromiter(delta, dtype=np.int64, count=len(delta)))
+            for f in front[in_delta].tolist():
+                neighbors.extend(delta[f])
+            front = front[~in_delta]
+
+        # gather friends[offsets[f]:offsets[f + 1]] for all f in the frontier
+        offsets = np.frombuffer(graph.offsets, dtype=np.int64)
+        starts = offsets[front]
+        lengths = offsets[front + 1] - starts
+        ends = np.cumsum(lengths)
+        indexes = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + lengths, lengths)
+        base_neighbors = np.frombuffer(graph.friends, dtype=np.int32)[indexes]
+        if neighbors:
+            base_neighbors = np.concatenate((base_neighbors, np.array(neighbors, dtype=np.int32)))
+
+        # drop the visited users, then the duplicates without sorting: each candidate writes its position into claims,
+        # exactly one of the positions of a user survives
+        visited = np.frombuffer(self.visited, dtype=np.uint8)
+        candidates = base_neighbors[visited[base_neighbors] == 0]
+        if self.claims is None or len(self.claims) < len(visited):
+            self.claims = np.empty(len(visited), dtype=np.int64)
+        positions = np.arange(len(candidates))
+        self.claims[candidates] = positions
+        new_front = candidates[self.claims[candidates] == positions]
+        visited[new_front] = 1
+        return new_front.tolist()
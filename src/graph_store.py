@@ -0,0 +1,335 @@
+from __future__ import print_function
+import threading
+import array
+
+# CompactGraph starts a compaction when more rows than this have changed since the last one...
+COMPACTION_MIN_ROWS = 100000
+
+# ...and they are more than this fraction of all the users
+COMPACTION_FRACTION = 0.05
+
+
+class AdjacencyGraph(list):
+    """
+    Graph store where item i is a dict of user i's friends, key is the friend's user index, value is the multiplicity
+    of the connection (number of befriend minus number of unfriend entries between the two users)
+
+    Both graph stores share the same interface: len(graph) is the number of users, graph[i] iterates over user i's
+    friends (each once), multiplicity() looks up a connection, add_node(), add_edge() and remove_edge() update the
+    graph
+    """
+
+    def add_node(self):
+        """
+        :return: int, index of the new user
+        """
+        self.append(dict())
+        return len(self) - 1
+
+    def add_edge(self, p1, p2):
+        """
+        Add a connection between p1 and p2, or increment its multiplicity
+
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: void
+        """
+        p1_friends = self[p1]
+        p1_friends[p2] = p1_friends.get(p2, 0) + 1
+        p2_friends = self[p2]
+        p2_friends[p1] = p2_friends.get(p1, 0) + 1
+
+    def remove_edge(self, p1, p2):
+        """
+        Decrement the multiplicity of the connection between p1 and p2, removing it when it reaches 0
+
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: bool, False if p1 and p2 are not connected
+        """
+        if p2 not in self[p1]:
+            return False
+        _decrement(self[p1], p2)
+        _decrement(self[p2], p1)
+        return True
+
+    def multiplicity(self, p1, p2):
+        """
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: int, multiplicity of the connection between p1 and p2, 0 if they are not connected
+        """
+        return self[p1].get(p2, 0)
+
+    def compact(self):
+        """
+        Nothing to compact, for compatibility with CompactGraph
+
+        :return: void
+        """
+        pass
+
+    def snapshot(self):
+        """
+        :return: CompactGraph, read only compacted copy of the graph, not affected by later changes
+        """
+        return _csr_snapshot(len(self), array.array('q', [0]), array.array('i'), array.array('I'),
+                             dict(enumerate(self)))
+
+
+class CompactGraph(object):
+    def __init__(self, compaction_min_rows=COMPACTION_MIN_ROWS, compaction_fraction=COMPACTION_FRACTION,
+                 background=True):
+        """
+        Graph store with a compressed sparse row (CSR) base and a small mutable delta overlay
+
+        The base stores the friends of all users in one array, user i's friends are
+        friends[offsets[i]:offsets[i + 1]], with the multiplicities of the connections in a parallel array; this costs
+        8 bytes per friend instead of ~100 for a dict entry. A row is copied into the delta as a dict the first time it
+        changes (copy on write), and new users only exist in the delta until the next compaction. Once enough rows
+        have changed, a compaction merges the delta into a new base, by default in a background thread while events
+        keep being applied to the delta
+
+        :param compaction_min_rows: int, minimum number of rows in the delta to start a compaction
+        :param compaction_fraction: float, minimum fraction of all users in the delta to start a compaction
+        :param background: bool, whether automatic compactions run in a background thread
+        """
+        self.offsets = array.array('q', [0])
+        self.friends = array.array('i')
+        self.multiplicities = array.array('I')
+        self.n_base = 0  # number of users in the base
+        self.n_users = 0
+
+        # rows changed since the last compaction, user index -> dict of friend index -> multiplicity
+        self.delta = dict()
+
+        self.compaction_min_rows = compaction_min_rows
+        self.compaction_fraction = compaction_fraction
+        self.background = background
+        self.compaction = None  # running background compaction thread
+        self.compacted = None  # result of the background compaction, (n_base, offsets, friends, multiplicities)
+        self.changed_during_compaction = set()  # rows changed after the background compaction started
+        self.n_compactions = 0
+
+    def __len__(self):
+        return self.n_users
+
+    def __getitem__(self, user):
+        """
+        :param user: int, user's index
+        :return: iterable, user's friends
+        """
+        row = self.delta.get(user)
+        if row is not None:
+            return row
+        return self.friends[self.offsets[user]:self.offsets[user + 1]]
+
+    def add_node(self):
+        """
+        :return: int, index of the new user
+        """
+        user = self.n_users
+        self.n_users += 1
+        self.delta[user] = dict()
+        if self.compaction is not None:
+            self.changed_during_compaction.add(user)
+        return user
+
+    def add_edge(self, p1, p2):
+        """
+        Add a connection between p1 and p2, or increment its multiplicity
+
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: void
+        """
+        p1_friends = self._writable_row(p1)
+        p1_friends[p2] = p1_friends.get(p2, 0) + 1
+        p2_friends = self._writable_row(p2)
+        p2_friends[p1] = p2_friends.get(p1, 0) + 1
+        self._maybe_compact()
+
+    def remove_edge(self, p1, p2):
+        """
+        Decrement the multiplicity of the connection between p1 and p2, removing it when it reaches 0
+
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: bool, False if p1 and p2 are not connected
+        """
+        if p2 not in self[p1]:
+            return False
+        _decrement(self._writable_row(p1), p2)
+        _decrement(self._writable_row(p2), p1)
+        self._maybe_compact()
+        return True
+
+    def multiplicity(self, p1, p2):
+        """
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :return: int, multiplicity of the connection between p1 and p2, 0 if they are not connected
+        """
+        row = self.delta.get(p1)
+        if row is not None:
+            return row.get(p2, 0)
+        start, end = self.offsets[p1], self.offsets[p1 + 1]
+        for i in range(start, end):
+            if self.friends[i] == p2:
+                return self.multiplicities[i]
+        return 0
+
+    def _writable_row(self, user):
+        """
+        :param user: int, user's index
+        :return: dict, user's row in the delta, copied from the base if needed
+        """
+        if self.compaction is not None:
+            self.changed_during_compaction.add(user)
+        row = self.delta.get(user)
+        if row is None:
+            start, end = self.offsets[user], self.offsets[user + 1]
+            row = self.delta[user] = dict(zip(self.friends[start:end], self.multiplicities[start:end]))
+        return row
+
+    def _maybe_compact(self):
+        """
+        Finish a background compaction that is done, or start a new one once the delta is large enough
+
+        :return: void
+        """
+        if self.compaction is not None:
+            if self.compacted is not None:
+                self._install_compaction()
+            return
+        if len(self.delta) >= max(self.compaction_min_rows, self.compaction_fraction * self.n_users):
+            if self.background:
+                self._start_compaction()
+            else:
+                self.compact()
+
+    def compact(self):
+        """
+        Merge the delta into a new base right away, waiting for a running background compaction first
+
+        :return: void
+        """
+        if self.compaction is not None:
+            self.compaction.join()
+            self._install_compaction()
+        self.offsets, self.friends, self.multiplicities = _build_csr(
+            self.n_users, self.offsets, self.friends, self.multiplicities, self.delta)
+        self.n_base = self.n_users
+        self.delta = dict()
+        self.n_compactions += 1
+
+    def snapshot(self):
+        """
+        :return: CompactGraph, read only compacted copy of the graph, not affected by later changes
+        """
+        return _csr_snapshot(self.n_users, self.offsets, self.friends, self.multiplicities, self.delta)
+
+    def _start_compaction(self):
+        """
+        Start merging a snapshot of the delta into a new base in a background thread, the base arrays are never
+        modified in place so the thread can read them while events are applied to the delta
+
+        :return: void
+        """
+        snapshot = dict((user, dict(row)) for user, row in self.delta.items())
+        n_users = self.n_users
+        offsets, friends, multiplicities = self.offsets, self.friends, self.multiplicities
+
+        def run():
+            self.compacted = (n_users,) + _build_csr(n_users, offsets, friends, multiplicities, snapshot)
+
+        self.changed_during_compaction = set()
+        self.compacted = None
+        self.compaction = threading.Thread(target=run)
+        self.compaction.daemon = True
+        self.compaction.start()
+
+    def _install_compaction(self):
+        """
+        Switch to the base built by the background compaction, only the rows changed since it started stay in the
+        delta
+
+        :return: void
+        """
+        n_base, offsets, friends, multiplicities = self.compacted
+        self.offsets, self.friends, self.multiplicities = offsets, friends, multiplicities
+        self.n_base = n_base
+        self.delta = dict((user, self.delta[user]) for user in self.changed_during_compaction)
+        self.compaction = None
+        self.compacted = None
+        self.changed_during_compaction = set()
+        self.n_compactions += 1
+
+    def memory_usage(self):
+        """
+        :return: int, approximate number of bytes used by the base arrays and the delta
+        """
+        base = sum(x.itemsize * len(x) for x in (self.offsets, self.friends, self.multiplicities))
+        # ~100 bytes per dict entry plus ~250 bytes per small dict
+        delta = sum(250 + 100 * len(row) for row in self.delta.values())
+        return base + delta
+
+
+def _build_csr(n_users, offsets, friends, multiplicities, delta):
+    """
+    Build new CSR arrays from a base and the rows that replace some of its rows
+
+    :param n_users: int, number of users in the new base, users missing from the old base must be in delta
+    :param offsets: array, offsets of the rows of the old base
+    :param friends: array, friends of the old base
+    :param multiplicities: array, multiplicities of the old base
+    :param delta: dict, user index -> dict of friend index -> multiplicity, rows replacing the old base
+    :return: tuple, (offsets, friends, multiplicities) of the new base
+    """
+    new_offsets = array.array('q', [0])
+    new_friends = array.array('i')
+    new_multiplicities = array.array('I')
+    for user in range(n_users):
+        row = delta.get(user)
+        if row is None:
+            start, end = offsets[user], offsets[user + 1]
+            new_friends.extend(friends[start:end])
+            new_multiplicities.extend(multiplicities[start:end])
+        else:
+            new_friends.extend(row.keys())
+            new_multiplicities.extend(row.values())
+        new_offsets.append(len(new_friends))
+    return new_offsets, new_friends, new_multiplicities
+
+
+def _csr_snapshot(n_users, offsets, friends, multiplicities, delta):
+    """
+    :param n_users: int, number of users, see _build_csr()
+    :param offsets: array, offsets of the rows of the base
+    :param friends: array, friends of the base
+    :param multiplicities: array, multiplicities of the base
+    :param delta: dict, user index -> dict of friend index -> multiplicity, rows replacing the base
+    :return: CompactGraph, with all the rows in its base
+    """
+    snapshot = CompactGraph()
+    snapshot.offsets, snapshot.friends, snapshot.multiplicities = _build_csr(n_users, offsets, friends,
+                                                                             multiplicities, delta)
+    snapshot.n_base = snapshot.n_users = n_users
+    return snapshot
+
+
+def _decrement(row, friend):
+    """
+    Decrement the multiplicity of friend in a row, removing it when it reaches 0
+
+    :param row: dict, friend index -> multiplicity
+    :param friend: int, friend's index
+    :return: void
+    """
+    if row[friend] > 1:
+        row[friend] -= 1
+    else:
+        del row[friend]
+
+
+GRAPH_STORES = {'dict': AdjacencyGraph, 'csr': CompactGraph}
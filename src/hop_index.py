@@ -0,0 +1,113 @@
+from __future__ import print_function
+
+# default maximum number of (user, friend within D hops) entries in the hop index before falling back to breadth first
+# search, ~40 bytes each
+HOP_INDEX_MAX_ENTRIES = 5000000
+
+
+class HopIndex(object):
+    def __init__(self, graph, D, max_entries=HOP_INDEX_MAX_ENTRIES):
+        """
+        Materialized Dth degree networks for D=1 and D=2, updated incrementally as connections are made and removed,
+        so find_friends() needs no graph traversal
+
+        For D=1 the network is user's row in the graph. For D=2, self.paths maps a user's index to a dict, key is the
+        index of a user within 2 hops, value is the number of paths of at most 2 hops between them: 1 for a direct
+        connection plus 1 for each friend they have in common. A connection made or removed changes the counts along
+        the paths through it, and a user leaves the network only once its count reaches 0, e.g. unfriending a direct
+        friend who is also a friend of a friend keeps them within 2 hops. A user's dict is built from the graph the
+        first time their network is needed, and only the dicts built so far are updated, so the batch_log costs nothing
+        and memory grows with the number of users checked
+
+        :param graph: AdjacencyGraph or CompactGraph, the user network
+        :param D: int, 1 or 2
+        :param max_entries: int, maximum number of entries in self.paths, see is_full()
+        """
+        if D not in (1, 2):
+            raise ValueError('hop index only supports D=1 and D=2, not D={}'.format(D))
+        self.graph = graph
+        self.D = D
+        self.max_entries = max_entries
+        self.paths = dict()
+        self.n_entries = 0
+
+    def neighbors(self, user):
+        """
+        :param user: int, user's index
+        :return: iterable, user indexes of the friends in user's Dth degree network, must not be modified
+        """
+        graph = self.graph
+        if self.D == 1:
+            friends = graph[user]
+            if user in friends:  # user befriended themselves
+                return [friend for friend in friends if friend != user]
+            return friends
+
+        user_paths = self.paths.get(user)
+        if user_paths is None:
+            user_paths = self.paths[user] = dict()
+            for friend in graph[user]:
+                if friend == user:
+                    continue
+                user_paths[friend] = user_paths.get(friend, 0) + 1
+                for friend_of_friend in graph[friend]:
+                    if friend_of_friend != user and friend_of_friend != friend:
+                        user_paths[friend_of_friend] = user_paths.get(friend_of_friend, 0) + 1
+            self.n_entries += len(user_paths)
+        return user_paths
+
+    def is_full(self):
+        """
+        :return: bool, whether the index is over max_entries
+        """
+        return self.n_entries > self.max_entries
+
+    def update(self, p1, p2, change):
+        """
+        Update the index for a connection between p1 and p2 that is made (change=1) or removed (change=-1), must be
+        called before the graph is updated, and only when p1 and p2 get connected or disconnected (not for a repeated
+        befriend entry)
+
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :param change: int, 1 or -1
+        :return: void
+        """
+        if self.D == 1 or p1 == p2 or not self.paths:
+            return
+        graph = self.graph
+        self._update_path(p1, p2, change)
+        self._update_path(p2, p1, change)
+        for a, b in ((p1, p2), (p2, p1)):
+            # paths a - b - friend and friend - b - a
+            for friend in graph[b]:
+                if friend != a and friend != b:
+                    self._update_path(a, friend, change)
+                    self._update_path(friend, a, change)
+
+    def _update_path(self, user, friend, change):
+        """
+        :param user: int, user's index
+        :param friend: int, friend's index
+        :param change: int, 1 or -1
+        :return: void
+        """
+        user_paths = self.paths.get(user)
+        if user_paths is None:  # not built yet
+            return
+        count = user_paths.get(friend, 0) + change
+        if count:
+            if count == change:
+                self.n_entries += 1
+            user_paths[friend] = count
+        else:
+            del user_paths[friend]
+            self.n_entries -= 1
+
+    def memory_usage(self):
+        """
+        :return: int, approximate number of bytes used by the index
+        """
+        # ~40 bytes per entry of a large dict with small int values (measured with tracemalloc on the sample dataset)
+        # plus ~250 bytes per small dict
+        return 250 * len(self.paths) + 40 * self.n_entries
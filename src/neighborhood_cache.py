@@ -0,0 +1,83 @@
+from __future__ import print_function
+import collections
+
+# default maximum number of users whose D-degree network is cached
+NEIGHBORHOOD_CACHE_SIZE = 10000
+
+
+class NeighborhoodCache(object):
+    name = 'neighborhood cache'  # prefix of stats()
+
+    def __init__(self, max_size=NEIGHBORHOOD_CACHE_SIZE):
+        """
+        Bounded cache of users' Dth degree networks, the least recently used entry is evicted when it is full
+        Entries are invalidated by the owner whenever a befriend/unfriend entry may change them, see
+        UserNetwork.update_neighborhoods()
+
+        :param max_size: int, maximum number of cached users, 0 disables the cache
+        """
+        self.max_size = max_size
+        self.neighborhoods = collections.OrderedDict()  # user index -> list of user indexes, least recent first
+
+        # counters for cache effectiveness
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0  # number of entries dropped because of a change in the network
+        self.evictions = 0  # number of entries dropped because the cache was full
+
+    def __len__(self):
+        return len(self.neighborhoods)
+
+    def get(self, user):
+        """
+        :param user: int, user's index
+        :return: list, user's cached Dth degree network, None if not cached
+        """
+        neighborhood = self.neighborhoods.get(user)
+        if neighborhood is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.neighborhoods.move_to_end(user)
+        return neighborhood
+
+    def put(self, user, neighborhood):
+        """
+        :param user: int, user's index
+        :param neighborhood: list, user's Dth degree network, must not be modified afterwards
+        :return: void
+        """
+        if self.max_size <= 0:
+            return
+        self.neighborhoods[user] = neighborhood
+        if len(self.neighborhoods) > self.max_size:
+            self.neighborhoods.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, users):
+        """
+        :param users: iterable, indexes of the users whose Dth degree network may have changed
+        :return: void
+        """
+        neighborhoods = self.neighborhoods
+        for user in users:
+            if neighborhoods.pop(user, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """
+        Drop all entries, e.g. when D changes
+
+        :return: void
+        """
+        self.invalidations += len(self.neighborhoods)
+        self.neighborhoods.clear()
+
+    def stats(self):
+        """
+        :return: str, summary of the counters
+        """
+        lookups = self.hits + self.misses
+        return '{}: {} hits, {} misses ({:.1f}% hit rate), {} invalidations, {} evictions'.format(
+            self.name, self.hits, self.misses, 100. * self.hits / lookups if lookups else 0., self.invalidations,
+            self.evictions)
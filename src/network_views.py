@@ -0,0 +1,133 @@
+from __future__ import print_function
+import collections
+import math
+import sys
+
+from neighborhood_cache import NeighborhoodCache
+
+# default maximum number of users whose network view is kept
+NETWORK_VIEWS_SIZE = 10000
+
+# a view's running sums are recomputed exactly once the magnitudes they went through (see NetworkView) reach this many
+# times their current value, which bounds their relative rounding error to ~1e-10: every few 100k purchases in a
+# stable window, right away after much larger amounts left it
+NETWORK_VIEW_MAX_DRIFT = 1 << 20
+
+# safety factor on the bound of the difference between the thresholds computed from the running sums and by
+# UserNetwork.flag_purchase(), see NetworkView.is_below_threshold()
+NETWORK_VIEW_GUARD_FACTOR = 2.
+
+EPSILON = sys.float_info.epsilon
+
+
+class NetworkView(object):
+    __slots__ = ('amounts', 'total', 'total_sq', 'drift', 'drift_sq')
+
+    def __init__(self, amounts, T):
+        """
+        Amounts of the latest T purchases in a user's Dth degree network, latest first, with their running sum and sum
+        of squares, so the mean and standard deviation used to flag a purchase cost O(1) instead of O(T)
+        Each addition or subtraction on a running sum has a rounding error of at most EPSILON times the magnitude of
+        its operands, self.drift and self.drift_sq add up these magnitudes since the last exact recomputation to bound
+        the error of self.total and self.total_sq
+
+        :param amounts: iterable, amounts of the latest T purchases in user's network, latest first
+        :param T: int, number of purchases in the view
+        """
+        self.amounts = collections.deque(amounts, maxlen=T)
+        self.recompute()
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def push(self, amount):
+        """
+        Add the latest purchase, dropping the oldest one once there are T
+
+        :param amount: float, purchase amount
+        :return: void
+        """
+        amounts = self.amounts
+        square = amount * amount
+        if len(amounts) == amounts.maxlen:
+            if not amounts:  # T == 0
+                return
+            oldest = amounts[-1]
+            self.drift += 2 * (abs(self.total) + abs(oldest) + abs(amount))
+            self.drift_sq += 2 * (abs(self.total_sq) + oldest * oldest + square)
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        else:
+            self.drift += abs(self.total) + abs(amount)
+            self.drift_sq += abs(self.total_sq) + square
+        amounts.appendleft(amount)
+        self.total += amount
+        self.total_sq += square
+        if (self.drift_sq > NETWORK_VIEW_MAX_DRIFT * self.total_sq or
+                self.drift > NETWORK_VIEW_MAX_DRIFT * abs(self.total)):
+            self.recompute()
+
+    def recompute(self):
+        """
+        Recompute the running sums exactly (correctly rounded sums of the amounts and of their rounded squares)
+
+        :return: void
+        """
+        self.total = math.fsum(self.amounts)
+        self.total_sq = math.fsum([x * x for x in self.amounts])
+        self.drift = abs(self.total)
+        self.drift_sq = 2 * self.total_sq
+
+    def is_below_threshold(self, amount):
+        """
+        Whether a purchase is certainly not anomalous, i.e. amount <= mean + 3 * sd as computed by
+        UserNetwork.flag_purchase() from the same amounts, decided from the running sums
+        Both the mean and the variance from the running sums and from flag_purchase()'s two pass computation are
+        within a bound of the true ones (flag_purchase() sums n terms, so its errors grow with n times the mean of the
+        squared amounts), and the standard deviations differ by at most the square root of the variance bound. A
+        purchase closer to the threshold than NETWORK_VIEW_GUARD_FACTOR times the bound on the difference is not
+        decided here, flag_purchase() recomputes the statistics exactly, as it does for the purchases it flags, whose
+        mean and sd are printed
+
+        :param amount: float, purchase amount
+        :return: bool, True if amount is below the threshold by more than the guard band, False if it may be above
+        """
+        n = len(self.amounts)
+        mean = self.total / n
+        mean_sq = max(self.total_sq / n, 0.)  # may be rounded below 0 once large amounts left the view
+        rms = math.sqrt(mean_sq)  # bounds the mean of the absolute amounts
+        mean_error = EPSILON * (self.drift / n + (n + 2) * rms)
+        variance_error = EPSILON * (self.drift_sq / n + 2 * rms * self.drift / n + 4 * (n + 4) * mean_sq)
+        guard = NETWORK_VIEW_GUARD_FACTOR * (mean_error + 3 * math.sqrt(variance_error))
+        return amount < mean + 3 * math.sqrt(max(mean_sq - mean * mean, 0.)) - guard
+
+
+class NetworkViews(NeighborhoodCache):
+    name = 'network views'
+
+    def __init__(self, max_size=NETWORK_VIEWS_SIZE):
+        """
+        Bounded cache of materialized network views, a user's view is a NetworkView of the amounts of the latest T
+        purchases in their Dth degree network, latest first, i.e. what the heap merge in UserNetwork.add_purchase()
+        returns. A view is built by the merge the first time it is needed, then kept up to date by push(): connections
+        go both ways, so a purchase enters the views of the users in the purchaser's Dth degree network. Views are
+        invalidated like the cached networks when a befriend/unfriend entry may change the network they were built
+        from, see UserNetwork.update_neighborhoods(), and the least recently used one is evicted when the cache is full
+
+        :param max_size: int, maximum number of views, 0 disables the views
+        """
+        super(NetworkViews, self).__init__(max_size)
+
+    def push(self, users, amount):
+        """
+        Add a purchase to the views of some users, if they have one
+
+        :param users: iterable, user indexes of the friends in the purchaser's Dth degree network
+        :param amount: float, purchase amount
+        :return: void
+        """
+        get = self.neighborhoods.get
+        for user in users:
+            view = get(user)
+            if view is not None:
+                view.push(amount)
@@ -1,15 +1,89 @@
 from __future__ import print_function
 from tqdm import tqdm
+import multiprocessing
+import collections
+import threading
+import argparse
 import pickle
-import heapq
+import struct
+import array
+import gzip
+import lzma
+import bz2
 import math
 import time
 import json
+import mmap
+import queue
+import stat
 import sys
+import re
+import os
+
+from hop_index import HopIndex, HOP_INDEX_MAX_ENTRIES
+from shared_network import export_network
+from neighborhood_cache import NeighborhoodCache, NEIGHBORHOOD_CACHE_SIZE
+from network_views import NetworkView, NetworkViews, NETWORK_VIEWS_SIZE
+from purchase_store import PURCHASE_STORES
+from graph_search import BreadthFirstSearch
+from graph_store import GRAPH_STORES
+
+# size of the read buffer used when streaming log files
+LOG_READ_BUFFER_SIZE = 1 << 20
+
+# size of the chunks read ahead by the background thread of ReadAheadReader, and maximum number of chunks waiting
+READ_AHEAD_CHUNK_SIZE = 1 << 20
+READ_AHEAD_MAX_CHUNKS = 16
+READ_AHEAD_CLOSE_TIMEOUT = 1.  # seconds to wait for the background thread to stop
+
+# file name for reading a log from stdin
+STDIN_LOG = '-'
+
+# compression codecs of compressed logs, by file extension; zstd needs the optional zstandard package
+COMPRESSED_LOG_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.lzma': 'lzma', '.zst': 'zstd'}
+
+# seconds between checks for new lines when following a stream log
+FOLLOW_POLL_INTERVAL = 0.05
+
+# approximate size of the chunks handed to each worker when parsing a log in parallel
+PARSE_CHUNK_SIZE = 4 << 20
+
+# json decoder backends, in order of preference when 'auto' is selected; the accelerated ones are optional
+JSON_DECODERS = ['orjson', 'simdjson', 'ujson', 'json']
+
+# number of lines between progress bar updates, when the progress bar is not updated on every line
+PROGRESS_UPDATE_LINES = 1 << 16
+
+# event type codes, the first item of the compact event records built from log entries
+EVENT_PARAMS = 0  # (EVENT_PARAMS, D, T)
+EVENT_PURCHASE = 1  # (EVENT_PURCHASE, timestamp, id, amount, amount as float)
+EVENT_BEFRIEND = 2  # (EVENT_BEFRIEND, timestamp, id1, id2)
+EVENT_UNFRIEND = 3  # (EVENT_UNFRIEND, timestamp, id1, id2)
+EVENT_ILLEGAL = 4  # (EVENT_ILLEGAL, entry_dict), valid json but not a valid log entry
+
+# binary event log format, see convert_log_to_event_log()
+EVENT_LOG_MAGIC = b'EVENTLOG'
+EVENT_LOG_HEADER_FORMAT = '<8s?'  # magic, big endian columns
+EVENT_LOG_BLOCK_FORMAT = '<II'  # number of events, number of new strings
+EVENT_LOG_BLOCK_SIZE = 1 << 16  # maximum number of events per block
+EVENT_RAW_LINE = 255  # code of the lines stored verbatim in a binary event log
+
+# fast path for the fixed shapes of log lines, json strings here cannot contain quotes, escapes or control characters
+_JSON_STRING = br'"([^"\\\x00-\x1f]*)"'
+_JSON_WHITESPACE = br'[ \t\n\r]*'
+_PURCHASE_LINE = re.compile(_JSON_WHITESPACE + br'\{"event_type":"purchase", "timestamp":' + _JSON_STRING +
+                            br', "id": ' + _JSON_STRING + br', "amount": ' + _JSON_STRING + br'\}' +
+                            _JSON_WHITESPACE + br'\Z')
+_FRIEND_LINE = re.compile(_JSON_WHITESPACE + br'\{"event_type":"(befriend|unfriend)", "timestamp":' + _JSON_STRING +
+                          br', "id1": ' + _JSON_STRING + br', "id2": ' + _JSON_STRING + br'\}' +
+                          _JSON_WHITESPACE + br'\Z')
+_PARAMS_LINE = re.compile(_JSON_WHITESPACE + br'\{"D":"([0-9]+)", "T":"([0-9]+)"\}' + _JSON_WHITESPACE + br'\Z')
 
 
 class UserNetwork(object):
-    def __init__(self, D=1, T=2, do_flag_purchases=False, debug_mode=False):
+    def __init__(self, D=1, T=2, do_flag_purchases=False, debug_mode=False, graph_store='dict',
+                 neighborhood_cache_size=NEIGHBORHOOD_CACHE_SIZE, hop_index_max_entries=HOP_INDEX_MAX_ENTRIES,
+                 purchase_store='ring', network_views_size=NETWORK_VIEWS_SIZE):
         """
         UserNetwork initialization with default parameters
         
@@ -17,6 +91,14 @@ class UserNetwork(object):
         :param T: int, specifies T recent purchases in network to be considered for anomaly detection
         :param do_flag_purchases: bool, specifies whether to flag anomalous purchase 
         :param debug_mode: bool, specifies whether in debug mode, in debug mode a few more lists will be populated
+        :param graph_store: str, one of GRAPH_STORES, 'dict' for a list of dicts, 'csr' for a compact CSR graph
+        :param neighborhood_cache_size: int, maximum number of users whose Dth degree network is cached, 0 disables
+        the cache
+        :param hop_index_max_entries: int, maximum size of the hop index used for D=1 and D=2, 0 disables the index
+        :param purchase_store: str, one of PURCHASE_STORES, 'ring' for a ring buffer of T slots per user, 'log' for an
+        append-only log of all users' purchases
+        :param network_views_size: int, maximum number of users whose latest T network purchases are kept up to date,
+        0 disables the views
         """
 
         # taking the default values for D, T at initialization actual value will be updated by first line in batch_log
@@ -26,12 +108,44 @@ class UserNetwork(object):
         # this counter increments as log entry is processed, this is a proxy of unique timestamp
         self.log_entry_counter = 0
 
-        # stores user network, key is user_id, value is the set user's 1st degree connections
-        self.network = dict()
+        # user ids from the log are interned into dense integers (user index) when first seen, all the structures
+        # below are indexed by the user index; user_ids maps user_id -> user index, user_names maps back
+        self.user_ids = dict()
+        self.user_names = []
+
+        # stores user network, self.network[i] iterates over user i's 1st degree connections (their user index),
+        # each connection has a multiplicity (number of befriend minus number of unfriend entries), see graph_store.py;
+        # befriend/unfriend are O(1) and repeated befriend entries don't duplicate friends in find_friends()
+        self.network = GRAPH_STORES[graph_store]()
+
+        # breadth first search engine over self.network, see reachable_users()
+        self.search = BreadthFirstSearch(self.network)
+
+        # caches the result of find_friends() for recent purchasers, entries are invalidated when a befriend/unfriend
+        # entry may change them, see update_neighborhoods()
+        self.neighborhoods = NeighborhoodCache(neighborhood_cache_size)
+
+        # for D=1 and D=2, materialized Dth degree networks of the users checked so far, updated as connections are
+        # made and removed, None if D>2 or the index grew over hop_index_max_entries, then find_friends() falls back to
+        # the cache
+        self.hop_index_max_entries = hop_index_max_entries
+        self.hop_index = self.build_hop_index()
+
+        # number of times two users got connected or disconnected, i.e. version of self.network
+        self.graph_version = 0
 
-        # stores purchase history of individual users, key is user_id, value is a list of 2-item lists in the format
-        # [log_entry_counter, purchase amount]
-        self.own_purchases = dict()
+        # read only copies of self.network taken by snapshot_network(), key is graph_version, see batch_scoring.py
+        self.snapshots = dict()
+
+        # stores purchase history of individual users, user i's latest T purchases as (log_entry_counter, purchase
+        # amount), by default in a ring buffer of T slots in two arrays shared by all users, see purchase_store.py;
+        # add_purchase() never reads more than T per user; see resize_purchase_histories() for what happens when T
+        # changes
+        self.own_purchases = PURCHASE_STORES[purchase_store](T)
+
+        # amounts of the latest T purchases in the Dth degree network of recent purchasers, updated as purchases are
+        # made and dropped when a befriend/unfriend entry may change the network, see network_views.py
+        self.views = NetworkViews(network_views_size)
 
         self.do_flag_purchases = do_flag_purchases
 
@@ -54,99 +168,111 @@ class UserNetwork(object):
     def process_log_entry(self, entry_dict):
         """
         Log entry process function. It processes incoming log entry, one line at a time, as a dictionary entry_dict.
-        It first checks log entry validity, if not valid then skip it. 
-        For valid entries, it decides whether it is a purchase, or befriend/unfriend and calls appropriate functions 
+        The entry is validated and converted into a compact event record (see entry_to_event()), then processed.
         
         :param entry_dict: current line of log entry as a dict
         :return: void
         """
-        # check validity of log entry
-        entry_type = None  # placeholder for determining entry type
-        try:
-            if set(entry_dict.keys()) == {'D', 'T'}:  # parameter entry to specify D and T
-                entry_type = 'params'
-            else:
-                if set(entry_dict.keys()) == {'event_type', 'timestamp', 'id', 'amount'} \
-                        and entry_dict['event_type'] == 'purchase':
-                    # purchase entry
+        self.process_event(entry_to_event(entry_dict))
 
-                    _ = float(entry_dict['amount'])  # test and see if amount can be converted to float
-                    entry_type = 'purchase'
-                if set(entry_dict.keys()) == {'event_type', 'timestamp', 'id1', 'id2'}:
-                    # befriend/unfriend entry
+    def process_event(self, event):
+        """
+        Event process function. It processes one compact event record produced by parse_log_line() or
+        entry_to_event(), and decides whether it is a parameter update, a purchase, or befriend/unfriend and calls
+        appropriate functions. Illegal entries are reported and skipped.
+        
+        :param event: tuple, compact event record, the first item is one of the EVENT_* codes
+        :return: void
+        """
+        event_type = event[0]
+        if event_type == EVENT_PURCHASE:
+            self.add_purchase(event)  # handles purchase entries
 
-                    if entry_dict['event_type'] == 'befriend':
-                        entry_type = 'befriend'
+        elif event_type == EVENT_BEFRIEND:
+            self.add_connection(event)  # handles "befriend" entries
 
-                    if entry_dict['event_type'] == 'unfriend':
-                        entry_type = 'unfriend'
-        except:
-            pass
+        elif event_type == EVENT_UNFRIEND:
+            self.remove_connection(event)  # handles "unfriend" entries
 
-        if entry_type is None:  # either no match or raised exception
-            print('illegal log entry: {}, skip'.format(entry_dict))
-            return
-        # end of validity check
-
-        if set(entry_dict.keys()) == {'D', 'T'}:  # set/update D, T parameters
-            self.D = int(entry_dict['D'])
-            self.T = int(entry_dict['T'])
+        elif event_type == EVENT_PARAMS:  # set/update D, T parameters
+            D_changed = event[1] != self.D
+            T_changed = event[2] != self.T
+            self.D = event[1]
+            self.T = event[2]
+            if D_changed:
+                self.neighborhoods.clear()
+                self.hop_index = self.build_hop_index()
+            if T_changed:
+                self.resize_purchase_histories()
+            if D_changed or T_changed:
+                self.views.clear()
             print('updated D=={}, T=={}'.format(self.D, self.T))
-        elif entry_dict['event_type'] == 'purchase':
-            self.add_purchase(entry_dict)  # handles purchase entries
 
-        elif entry_dict['event_type'] == 'befriend':
-            self.add_connection(entry_dict)  # handles "befriend" entries
+        else:  # either no match or raised exception during validity check
+            print('illegal log entry: {}, skip'.format(event[1]))
 
-        elif entry_dict['event_type'] == 'unfriend':
-            self.remove_connection(entry_dict)  # handles "unfriend" entries
-
-    def add_user_if_new(self, user_id):
+    def intern_user(self, user_id):
         """
-        Helper function for checking if user exists, otherwise initialize user in self.network and self.own_purchases
+        Helper function mapping a user id to its user index, if user is new, a new index is assigned and user is
+        initialized in self.network and self.own_purchases
         :param user_id: str, user's id from log entry
-        :return: bool, True if user is new, False if user already exists
+        :return: int, user index
         """
-        if user_id not in self.network:
-            self.network[user_id] = []
-            self.own_purchases[user_id] = []
-            return True  # user is new
-        else:
-            return False
+        user = self.user_ids.get(user_id)
+        if user is None:  # user is new
+            user = self.user_ids[user_id] = len(self.user_names)
+            self.user_names.append(user_id)
+            self.network.add_node()
+            self.own_purchases.add_user()
+        return user
 
-    def add_connection(self, entry_dict):
+    def resize_purchase_histories(self):
+        """
+        Helper function resizing the purchase history of every user to the current T, keeping the latest purchases
+        When T increases, the purchases dropped while it was smaller are lost, so until users make enough new purchases
+        their network's latest T purchases may be missing older ones that an unbounded history would have kept
+        
+        :return: void
+        """
+        self.own_purchases.resize(self.T)
+
+    def add_connection(self, event):
         """
         Function to handle befriend activities.
         
-        :param entry_dict: current log entry as a dictionary
+        :param event: tuple, befriend event record (EVENT_BEFRIEND, timestamp, id1, id2)
         :return: void
         """
-        p1_id = entry_dict['id1']
-        p2_id = entry_dict['id2']
-        self.add_user_if_new(p1_id)
-        self.add_user_if_new(p2_id)
+        p1 = self.intern_user(event[2])
+        p2 = self.intern_user(event[3])
+
+        # a new connection (not a repeated befriend entry) may change the Dth degree networks around it
+        if not self.network.multiplicity(p1, p2):
+            self.update_neighborhoods(p1, p2, 1)
 
         # add connection between p1 and p2
-        self.network[p1_id].append(p2_id)
-        self.network[p2_id].append(p1_id)
+        self.network.add_edge(p1, p2)
 
-    def remove_connection(self, entry_dict):
+    def remove_connection(self, event):
         """
         Function to handle unfriend activities.
+        A connection made by several befriend entries is removed once the same number of unfriend entries is seen.
         
-        :param entry_dict: current log entry as a dictionary
+        :param event: tuple, unfriend event record (EVENT_UNFRIEND, timestamp, id1, id2)
         :return: void
         """
-        p1_id = entry_dict['id1']
-        p2_id = entry_dict['id2']
-        if p1_id in self.network and p2_id in self.network:
-            # remove connection between p1 and p2
-            self.network[p1_id].remove(p2_id)
-            self.network[p2_id].remove(p1_id)
-        else:  # somehow p1 or p2 are not in the network yet we have a unfriend request
+        p1 = self.user_ids.get(event[2])
+        p2 = self.user_ids.get(event[3])
+        multiplicity = self.network.multiplicity(p1, p2) if p1 is not None and p2 is not None else 0
+        if multiplicity:
+            # only removing the last befriend entry disconnects p1 and p2
+            if multiplicity == 1:
+                self.update_neighborhoods(p1, p2, -1)
+            self.network.remove_edge(p1, p2)
+        else:  # somehow p1 and p2 are not connected yet we have a unfriend request
             pass  # currently do nothing about this, but we can change this
 
-    def add_purchase(self, entry_dict):
+    def add_purchase(self, event):
         """
         Function to handle purchase entries
         The key steps are: 
@@ -155,72 +281,67 @@ class UserNetwork(object):
             - if self.do_flag_purchases == True, meaning we need to flag anomaly purchases:
                 - find all the friends in user's D-th network
                 - get the purchase histories of each friend (already sorted by log_entry_counter)
-                - merge friends' purchase histories while maintaining sorted order, get the latest T entries
-                - calculated mean and sd and determine if current purchase is anomalous
+                - merge friends' purchase histories while maintaining sorted order, get the latest T entries, unless
+                user's network view already has them (see network_views.py)
+                - calculated mean and sd and determine if current purchase is anomalous, in O(1) from the running
+                sums of the view unless it is close to the threshold
                 - record flagged purchase in specified format
-        :param entry_dict: current log entry as a dictionary
+        :param event: tuple, purchase event record (EVENT_PURCHASE, timestamp, id, amount, amount as float)
         :return: void
         """
-        user_id = entry_dict['id']
-        purchase_amount = float(entry_dict['amount'])
-        # timestamp = datetime.datetime.strptime(entry_dict['timestamp'], '%Y-%m-%d %H:%M:%S')
+        purchase_amount = event[4]
 
-        self.add_user_if_new(user_id)  # handle new users
+        user = self.user_ids.get(event[2])
+        if user is None:
+            user = self.intern_user(event[2])  # handle new users
 
-        # now update user's own purchase history, each entry is a 2-item list: [log_entry_counter, purchase amount]
-        # the latest entry has the most negative (smallest) log_entry_counter
-        self.own_purchases[user_id].append([self.log_entry_counter, purchase_amount])
+        # now update user's own purchase history, the latest entry has the most negative (smallest) log_entry_counter
+        self.own_purchases.append(user, self.log_entry_counter, purchase_amount)
         self.log_entry_counter -= 1
 
-        if not self.do_flag_purchases:  # stops here if no need to flag purchases
+        if not self.do_flag_purchases and not self.views:  # stops here if no need to flag purchases
             return
 
         start_time = time.time()
         # connected users is a set of users in user's social circle up to Dth degree connectivity
-        connected_users = self.find_friends(user_id)
+        connected_users = self.find_friends(user)
         if self.debug_mode:
             self.find_friends_time_log.append(time.time() - start_time)
             self.n_friends_log.append(len(connected_users))
             # record # of connected users in log in debug mode
 
+        # user is in the Dth degree network of each connected user, add the purchase to their network views
+        self.views.push(connected_users, purchase_amount)
+        if not self.do_flag_purchases:
+            return
+
         start_time = time.time()
-        recent_purchases = []
-        heap = [[self.own_purchases[x][-1], len(self.own_purchases[x]) - 1, self.own_purchases[x]] for x in
-                connected_users if self.own_purchases[x]]
         if self.debug_mode:
-            s = 0
-            for m in heap:
-                s += len(m[2])
-            # record total # of items in list of lists
-            self.n_items_to_merge_log.append(s)
-
-        heapq.heapify(heap)
-        while heap:
-            min_pair = heapq.heappop(heap)
+            # record total # of items in the purchase histories to merge
+            self.n_items_to_merge_log.append(sum(self.own_purchases.n_purchases(x) for x in connected_users))
 
-            recent_purchases.append(min_pair[0][1])
-
-            if min_pair[1] > 0:
-                min_pair[1] -= 1
-                min_pair[0] = min_pair[2][min_pair[1]]
-                heapq.heappush(heap, min_pair)
-
-            if len(recent_purchases) == self.T:
-                break
+        view = self.views.get(user)
+        if view is None:
+            # heap merge of the friends' purchase histories, latest first
+            view = NetworkView((amount for log_entry_counter, amount in
+                                self.own_purchases.latest_purchases(connected_users, self.T)), self.T)
+            self.views.put(user, view)
 
         if self.debug_mode:
             self.merge_time_log.append(time.time() - start_time)
 
-        # check if purchase should be flagged
-        if len(recent_purchases) >= 2:
-            self.flag_purchase(recent_purchases, purchase_amount, entry_dict)
+        # check if purchase should be flagged, the running sums of the view clear most purchases in O(1), the others
+        # are checked exactly
+        if len(view) >= 2 and not view.is_below_threshold(purchase_amount):
+            self.flag_purchase(view.amounts, purchase_amount, event)
 
-    def flag_purchase(self, recent_purchases, purchase_amount, entry_dict):
+    def flag_purchase(self, recent_purchases, purchase_amount, event):
         """
         Flag anomalous purchase given recent purchase history from network and purchase amount of current purchase
-        :param recent_purchases: list of float, recent purchase history from network
+        :param recent_purchases: list or deque of float, recent purchase history from network
         :param purchase_amount: float, current purchase amount
-        :param entry_dict: current log entry as a dict
+        :param event: tuple, purchase event record (EVENT_PURCHASE, timestamp, id, amount, amount as float), its
+        original user id and amount strings are used in the output
         :return: void
         """
         # print(recent_purchases)
@@ -233,36 +354,112 @@ class UserNetwork(object):
             sum([(x - current_mean) ** 2 for x in recent_purchases]) * 1.0 / len(recent_purchases))
 
         if purchase_amount > current_mean + 3 * current_std:
-            filled_str = self.flagged_purchase_template.format(entry_dict['event_type'], entry_dict['timestamp'],
-                                                               entry_dict['id'], entry_dict['amount'], current_mean,
+            filled_str = self.flagged_purchase_template.format('purchase', event[1], event[2], event[3], current_mean,
                                                                current_std)
             self.flagged_purchases.append(filled_str)
 
-    def find_friends(self, user_id):
+    def build_hop_index(self):
         """
-        Function to find all the friends in user's Dth degree network
-        this is a non recursive implementation of breadth first search
+        Helper function creating an empty hop index for the current D and network
         
-        :param user_id: str, user's id from log entry
-        :return: list, friends in user's Dth degree network as a list
+        :return: HopIndex, None if D is not 1 or 2
         """
-        depth = self.D
-        if depth <= 1:
+        if self.D not in (1, 2) or self.hop_index_max_entries <= 0:
+            return None
+        return HopIndex(self.network, self.D, self.hop_index_max_entries)
+
+    def drop_full_hop_index(self):
+        """
+        Helper function falling back to breadth first search once the hop index is over hop_index_max_entries
+        
+        :return: void
+        """
+        if self.hop_index.is_full():
+            print('hop index over {} entries, fall back to breadth first search'.format(self.hop_index_max_entries))
+            self.hop_index = None
+
+    def update_neighborhoods(self, p1, p2, change):
+        """
+        Update the hop index and drop the cached Dth degree networks and network views for a connection between p1
+        and p2 that is made (change=1) or removed (change=-1), must be called before the network is updated
+        A path of at most D hops through the connection starts with at most D-1 hops to p1 or p2 without it, so only
+        the cached networks and views of the users within D-1 hops of p1 or p2 are affected
+        
+        :param p1: int, user's index
+        :param p2: int, friend's index
+        :param change: int, 1 or -1
+        :return: void
+        """
+        self.graph_version += 1
+        if self.hop_index is not None:
+            self.hop_index.update(p1, p2, change)
+            self.drop_full_hop_index()
+        if not self.neighborhoods and not self.views:
             return
+        for affected in (self.reachable_users(p1, self.D - 1), self.reachable_users(p2, self.D - 1), (p1, p2)):
+            self.neighborhoods.invalidate(affected)
+            self.views.invalidate(affected)
+
+    def snapshot_network(self):
+        """
+        Take a read only copy of the network at the current graph_version, e.g. to score purchases against it later
+        with batch_scoring.find_friends_batch(); snapshots are kept until removed from self.snapshots
+        
+        :return: int, version of the snapshot
+        """
+        if self.graph_version not in self.snapshots:
+            self.snapshots[self.graph_version] = self.network.snapshot()
+        return self.graph_version
+
+    def find_friends(self, user):
+        """
+        Function to find all the friends in user's Dth degree network, from the hop index if there is one, otherwise
+        cached in self.neighborhoods
+        
+        :param user: int, user's index
+        :return: iterable, user indexes of the friends in user's Dth degree network, must not be modified
+        """
+        hop_index = self.hop_index
+        if hop_index is not None:
+            connected_users = hop_index.neighbors(user)
+            self.drop_full_hop_index()
+            return connected_users
+        connected_users = self.neighborhoods.get(user)
+        if connected_users is None:
+            connected_users = self.reachable_users(user, self.D)
+            self.neighborhoods.put(user, connected_users)
+        return connected_users
 
-        fronts = [user_id]
-        visited_nodes = set()
-        while depth > 0:
-            new_front = set()
-            for f in fronts:
-                for friend in self.network[f]:
-                    if friend != user_id and friend not in visited_nodes:
-                        new_front.add(friend)
-            visited_nodes = visited_nodes | new_front
-            fronts = new_front
-            depth = depth - 1
+    def reachable_users(self, user, depth):
+        """
+        Function to find all the users within depth hops of user, not including user
+        this is a non recursive implementation of breadth first search, see graph_search.py
+        
+        :param user: int, user's index
+        :param depth: int, maximum number of hops
+        :return: list, user indexes of the users within depth hops
+        """
+        return self.search.reachable_users(user, depth)
 
-        return list(visited_nodes)
+    def neighborhood_stats(self):
+        """
+        :return: str, size of the hop index if there is one, otherwise the neighborhood cache counters, then the
+        network views counters, then the size of the purchase histories and of the graph for --graph-store csr
+        """
+        if self.hop_index is not None:
+            stats = 'hop index (D={}): {} entries, ~{:.1f}MB'.format(
+                self.D, self.hop_index.n_entries, self.hop_index.memory_usage() / 1e6)
+        else:
+            stats = self.neighborhoods.stats()
+        stats = '{}\n{}\npurchase histories: {} users, ~{:.1f}MB'.format(
+            stats, self.views.stats(), len(self.own_purchases), self.own_purchases.memory_usage() / 1e6)
+        if hasattr(self.own_purchases, 'n_compactions'):  # PurchaseLog
+            stats += ', {} log entries, {} compactions'.format(
+                len(self.own_purchases.counters), self.own_purchases.n_compactions)
+        if hasattr(self.network, 'memory_usage'):  # CompactGraph
+            stats += '\ncsr graph: {} users, {} compactions, ~{:.1f}MB'.format(
+                len(self.network), self.network.n_compactions, self.network.memory_usage() / 1e6)
+        return stats
 
     def debug_log(self, log_file):
         """
@@ -282,30 +479,834 @@ class UserNetwork(object):
             pickle.dump(log_dict, f)
 
 
-def process_log(filename, network):
+def entry_to_event(entry_dict):
+    """
+    Check validity of a decoded log entry and convert it into a compact event record
+    
+    :param entry_dict: log entry as a dict
+    :return: tuple, event record, the first item is one of the EVENT_* codes, see their definition for the layout
+    """
+    try:
+        keys = set(entry_dict.keys())
+        if keys == {'D', 'T'}:  # parameter entry to specify D and T
+            return EVENT_PARAMS, int(entry_dict['D']), int(entry_dict['T'])
+
+        event_type = entry_dict['event_type']
+        if keys == {'event_type', 'timestamp', 'id', 'amount'} and event_type == 'purchase':
+            # purchase entry, also tests if amount can be converted to float
+            return (EVENT_PURCHASE, entry_dict['timestamp'], entry_dict['id'], entry_dict['amount'],
+                    float(entry_dict['amount']))
+
+        if keys == {'event_type', 'timestamp', 'id1', 'id2'}:  # befriend/unfriend entry
+            if event_type == 'befriend':
+                return EVENT_BEFRIEND, entry_dict['timestamp'], entry_dict['id1'], entry_dict['id2']
+            if event_type == 'unfriend':
+                return EVENT_UNFRIEND, entry_dict['timestamp'], entry_dict['id1'], entry_dict['id2']
+    except:
+        pass
+
+    return EVENT_ILLEGAL, entry_dict  # either no match or raised exception
+
+
+def parse_log_line(line, json_loads=json.loads, start=0, end=None):
+    """
+    Parse one raw log line into a compact event record
+    Lines in the exact shape written by the upstream log producer are recognized directly with a regular expression,
+    any other line goes through json_loads and entry_to_event()
+    
+    :param line: bytes, raw log line, or any buffer (e.g. a mmap) holding the line between start and end
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :param start: int, offset of the line in the buffer
+    :param end: int, offset just past the end of the line in the buffer, None for the end of the buffer
+    :return: tuple, event record, the first item is one of the EVENT_* codes
+    :raise: ValueError (or the decoder's own error) if the line is not valid json
+    """
+    if end is None:
+        end = len(line)
+    try:
+        match = _PURCHASE_LINE.match(line, start, end)
+        if match is not None:
+            timestamp, user_id, amount = match.groups()
+            return (EVENT_PURCHASE, timestamp.decode('utf-8'), user_id.decode('utf-8'), amount.decode('utf-8'),
+                    float(amount))
+
+        match = _FRIEND_LINE.match(line, start, end)
+        if match is not None:
+            event_type, timestamp, id1, id2 = match.groups()
+            return (EVENT_BEFRIEND if event_type == b'befriend' else EVENT_UNFRIEND, timestamp.decode('utf-8'),
+                    id1.decode('utf-8'), id2.decode('utf-8'))
+
+        match = _PARAMS_LINE.match(line, start, end)
+        if match is not None:
+            return EVENT_PARAMS, int(match.group(1)), int(match.group(2))
+    except ValueError:  # e.g. invalid utf-8 or amount, let the generic path decide
+        pass
+
+    if start != 0 or end != len(line):
+        line = line[start:end]
+    return entry_to_event(json_loads(line))
+
+
+def get_json_decoder(name='auto'):
+    """
+    Look up the function used to decode each log line into a dictionary
+    
+    :param name: str, one of JSON_DECODERS, or 'auto' to pick the fastest installed backend
+    :return: function, takes a log line as bytes and returns the decoded object
+    """
+    if name == 'auto':
+        candidates = JSON_DECODERS
+    elif name in JSON_DECODERS:
+        candidates = [name]
+    else:
+        raise ValueError('unknown json decoder: {}'.format(name))
+
+    for candidate in candidates:
+        try:
+            module = __import__(candidate)
+        except ImportError:
+            continue
+        return module.loads
+
+    raise ValueError('json decoder {} is not installed'.format(name))
+
+
+class ReadAheadReader(object):
+    def __init__(self, f, chunk_size=READ_AHEAD_CHUNK_SIZE, max_chunks=READ_AHEAD_MAX_CHUNKS, close_file=True):
+        """
+        Iterates over the lines of a binary file object, while a background thread reads (and decompresses) the
+        next chunks of the file ahead into a bounded queue, so reading overlaps with processing without unbounded
+        memory growth
+        
+        :param f: file, binary file object, e.g. a decompressing reader or stdin
+        :param chunk_size: int, maximum size of each read from f in bytes
+        :param max_chunks: int, maximum number of chunks read ahead and waiting to be processed
+        :param close_file: bool, whether to close f when the ReadAheadReader is closed
+        """
+        self.f = f
+        self.close_file = close_file
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(max_chunks)
+        self.closed = False
+
+        # throughput of the background thread
+        self.bytes_read = 0
+        self.read_time = 0.  # seconds spent reading from f, not waiting for room in the queue
+
+        self.thread = threading.Thread(target=self._read_ahead)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read_ahead(self):
+        """
+        Background thread, reads chunks from the file into the queue until end of file or close()
+        Read errors are passed through the queue and raised in the consumer
+        
+        :return: void
+        """
+        # read1() returns as soon as some data is available, which matters for pipes
+        read = getattr(self.f, 'read1', self.f.read)
+        try:
+            while not self.closed:
+                start_time = time.time()
+                chunk = read(self.chunk_size)
+                self.read_time += time.time() - start_time
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                self.chunks.put(chunk)
+        except Exception as e:
+            self.chunks.put(e)
+        self.chunks.put(None)  # end of file
+
+    def __iter__(self):
+        """
+        :return: iterator over the lines of the file as bytes, without the newline
+        """
+        remainder = b''
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()  # incomplete last line, completed by the next chunk
+            for line in lines:
+                yield line
+        if remainder:  # last line without newline
+            yield remainder
+
+    def close(self):
+        """
+        Stop the background thread and close the file
+        If the thread is still blocked reading (e.g. from a pipe that is not closed yet), it is left behind as a
+        daemon thread and the file is not closed
+        
+        :return: void
+        """
+        self.closed = True
+        for _ in range(2):
+            try:  # make room in the queue in case the thread is waiting for it
+                while True:
+                    self.chunks.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join(READ_AHEAD_CLOSE_TIMEOUT)
+        if self.close_file and not self.thread.is_alive():
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stdin_log():
+    """
+    Open stdin for reading a log piped into the program
+    A background thread reads whatever is available in the pipe in large chunks, so bursts from the producer are
+    absorbed by the bounded read ahead buffer and there is no system call per line
+    
+    :return: ReadAheadReader, iterable over the lines of the log
+    """
+    return ReadAheadReader(getattr(sys.stdin, 'buffer', sys.stdin), close_file=False)
+
+
+def get_log_codec(filename):
+    """
+    Find the compression codec of a log file from its extension
+    
+    :param filename: str, file name as a string
+    :return: str, one of the values of COMPRESSED_LOG_EXTENSIONS, or None if the file is not compressed
+    """
+    return COMPRESSED_LOG_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def open_compressed_log(filename):
+    """
+    Open a compressed log file for streaming decompression
+    
+    :param filename: str, file name with one of the extensions in COMPRESSED_LOG_EXTENSIONS
+    :return: file, binary file object returning the decompressed log
+    """
+    codec = get_log_codec(filename)
+    if codec == 'gzip':
+        return gzip.open(filename, 'rb')
+    if codec == 'bz2':
+        return bz2.BZ2File(filename, 'rb')
+    if codec == 'lzma':
+        return lzma.open(filename, 'rb')
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('the zstandard package is needed to read {}'.format(filename))
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+    raise ValueError('{} is not a compressed log'.format(filename))
+
+
+def process_log(filename, network, json_loads=json.loads, parse_workers=1, use_mmap=False):
     """
     Process either batch_log or stream_log
+    The file is streamed line by line, so memory usage does not depend on the size of the log.
+    Compressed logs are decompressed on the fly in a background thread, selected by file extension.
+    The log is read from stdin when filename is '-', through a bounded read ahead buffer filled by a background thread.
+    Binary event logs (see convert_log_to_event_log()) are detected and replayed directly
     
     :param filename: str, file name as a string
     :param network: UserNetwork, an instance of UserNetwork class
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :param parse_workers: int, number of processes parsing the log in parallel, see process_log_parallel(), only for
+    regular files, other logs are streamed
+    :param use_mmap: bool, whether to read the file through a memory map, see process_log_mmap(), only for regular
+    files, other logs are streamed
     :return: void
     """
-    with open(filename, 'r') as f:
-        log = f.readlines()
-    print('read {}'.format(filename))
+    codec = get_log_codec(filename)
+    if filename != STDIN_LOG and codec is None:  # pipes and compressed logs can only be streamed
+        # reading ahead in a FIFO or process substitution (e.g. <(zcat log.gz)) would consume what it reads
+        regular_file = is_regular_file(filename)
+        if regular_file and is_event_log(filename):
+            process_event_log(filename, network, json_loads)
+            return
+        if parse_workers > 1 and regular_file:  # chunks are byte ranges of the file
+            process_log_parallel(filename, network, json_loads, parse_workers)
+            return
+        if use_mmap and regular_file:  # only regular files can be mapped
+            process_log_mmap(filename, network, json_loads)
+            return
+
+    if filename == STDIN_LOG:
+        print('processing stdin')
+        f = open_stdin_log()
+    elif codec is not None:
+        print('processing {} ({})'.format(filename, codec))
+        f = ReadAheadReader(open_compressed_log(filename))
+    else:
+        print('processing {}'.format(filename))
+        f = open(filename, 'rb', LOG_READ_BUFFER_SIZE)
+
+    with f:
+        for i, line in enumerate(tqdm(f, unit=' lines')):
+            try:
+                event = parse_log_line(line, json_loads)
+            except:
+                print('failed to parse line {}, skip'.format(i))
+                continue
+            network.process_event(event)
+
+    if codec is not None:
+        megabytes = f.bytes_read / 1e6
+        print('decompressed {}: {:.1f} MB -> {:.1f} MB in {:.2f} s, {:.1f} MB/s'.format(
+            codec, os.path.getsize(filename) / 1e6, megabytes, f.read_time, megabytes / max(f.read_time, 1e-9)))
+
+
+def process_log_mmap(filename, network, json_loads=json.loads):
+    """
+    Process either batch_log or stream_log from a memory mapped file
+    Newlines are searched directly in the mapped file and the parser matches each line in place, so lines are not
+    copied into separate bytes or str objects; only the fields of the event records are, and the rare lines that
+    need the json decoder
+    
+    :param filename: str, file name as a string
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :return: void
+    """
+    print('processing {} (mmap)'.format(filename))
+    file_size = os.path.getsize(filename)
+    if file_size == 0:  # empty files cannot be mapped
+        return
+
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mapped, 'madvise'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        progress = tqdm(total=file_size, unit='B', unit_scale=True)
+        find = mapped.find
+        start = 0
+        i = 0  # line number
+        while start < file_size:
+            end = find(b'\n', start)
+            if end < 0:  # last line without newline
+                end = file_size
+            try:
+                event = parse_log_line(mapped, json_loads, start, end)
+            except:
+                print('failed to parse line {}, skip'.format(i))
+            else:
+                network.process_event(event)
+            i += 1
+            if i % PROGRESS_UPDATE_LINES == 0:
+                progress.update(end - progress.n)
+            start = end + 1
+        progress.update(file_size - progress.n)
+        progress.close()
+    finally:
+        mapped.close()
 
-    print('processing {}'.format(filename))
-    for i in tqdm(range(len(log))):
+
+def follow_log(filename, network, output, json_loads=json.loads, poll_interval=FOLLOW_POLL_INTERVAL,
+               idle_timeout=None):
+    """
+    Process stream_log as a live stream, like `tail -F`: the lines already in the file are processed, then new lines
+    are processed as soon as they are appended. Flagged purchases are written to output as soon as they are found.
+    The file is reopened when it is rotated (replaced by a new file), and read from the beginning again when it is
+    truncated. Runs until interrupted, or until no line is appended for idle_timeout seconds
+    
+    :param filename: str, file name as a string, the file does not need to exist yet
+    :param network: UserNetwork, an instance of UserNetwork class, with do_flag_purchases set
+    :param output: file, text file the flagged purchases are written to, in the same format as the output of main()
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :param poll_interval: float, seconds to wait before checking for new lines again once the end of file is reached
+    :param idle_timeout: float, seconds without new lines after which to stop following, None to follow forever
+    :return: int, number of flagged purchases written
+    """
+    print('following {}'.format(filename))
+    f = None
+    i = 0  # line number
+    n_flagged = 0
+    partial_line = b''  # last line of the file while its newline has not been appended yet
+    partial_line_processed = False  # whether partial_line was already a complete entry and has been processed
+    last_line_time = time.time()
+
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(filename, 'rb')
+                except IOError:  # not created yet, or in the middle of a rotation
+                    f = None
+
+            line = f.readline() if f is not None else b''
+            if line:
+                last_line_time = time.time()
+                line = partial_line + line
+                if not line.endswith(b'\n'):
+                    partial_line = line
+                    continue
+                if partial_line_processed:  # only the end of an entry already processed, e.g. its newline
+                    partial_line, partial_line_processed = b'', False
+                    continue
+                partial_line = b''
+
+            else:  # end of file, check for a partial last line, rotation and truncation before waiting
+                if partial_line and not partial_line_processed:
+                    # the producer may not write the newline until the next entry, process the line right away
+                    # when it is already a complete entry
+                    try:
+                        event = parse_log_line(partial_line, json_loads)
+                    except:
+                        event = None
+                    if event is not None:
+                        partial_line_processed = True
+                        line = partial_line
+
+                if not line:
+                    if f is not None and _log_rotated(f, filename):
+                        print('{} rotated, reopen'.format(filename))
+                        line = partial_line if not partial_line_processed else b''
+                        partial_line, partial_line_processed = b'', False
+                        f.close()
+                        f = None
+                    elif f is not None and os.fstat(f.fileno()).st_size < f.tell():
+                        print('{} truncated, read from the beginning'.format(filename))
+                        partial_line, partial_line_processed = b'', False
+                        f.seek(0)
+                        continue
+
+                if not line:
+                    if idle_timeout is not None and time.time() - last_line_time > idle_timeout:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+            try:
+                event = parse_log_line(line, json_loads)
+            except:
+                print('failed to parse line {}, skip'.format(i))
+            else:
+                network.process_event(event)
+            i += 1
+
+            if network.flagged_purchases:
+                n_flagged = write_flagged_purchases(network, output, n_flagged)
+    except KeyboardInterrupt:
+        print('stopped following {}'.format(filename))
+    finally:
+        if f is not None:
+            f.close()
+
+    if partial_line and not partial_line_processed:  # last line without newline
         try:
-            entry_dict = json.loads(log[i])
+            event = parse_log_line(partial_line, json_loads)
         except:
             print('failed to parse line {}, skip'.format(i))
+        else:
+            network.process_event(event)
+        n_flagged = write_flagged_purchases(network, output, n_flagged)
+    return n_flagged
+
+
+def follow_stdin_log(network, output, json_loads=json.loads):
+    """
+    Process stream_log piped into stdin as a live stream, flagged purchases are written to output as soon as they are
+    found. Runs until the producer closes the pipe
+    
+    :param network: UserNetwork, an instance of UserNetwork class, with do_flag_purchases set
+    :param output: file, text file the flagged purchases are written to, in the same format as the output of main()
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :return: int, number of flagged purchases written
+    """
+    print('following stdin')
+    n_flagged = 0
+    with open_stdin_log() as f:
+        try:
+            for i, line in enumerate(f):
+                try:
+                    event = parse_log_line(line, json_loads)
+                except:
+                    print('failed to parse line {}, skip'.format(i))
+                    continue
+                network.process_event(event)
+                if network.flagged_purchases:
+                    n_flagged = write_flagged_purchases(network, output, n_flagged)
+        except KeyboardInterrupt:
+            print('stopped following stdin')
+    return n_flagged
+
+
+def write_flagged_purchases(network, output, n_flagged):
+    """
+    Write the pending flagged purchases of the network to output and clear them, used when following a stream log
+    
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param output: file, text file the flagged purchases are written to, in the same format as the output of main()
+    :param n_flagged: int, number of flagged purchases already written to output
+    :return: int, number of flagged purchases written to output so far
+    """
+    for flagged_purchase in network.flagged_purchases:
+        if n_flagged:
+            output.write('\n')
+        output.write(flagged_purchase)
+        n_flagged += 1
+    output.flush()
+    del network.flagged_purchases[:]
+    return n_flagged
+
+
+def _log_rotated(f, filename):
+    """
+    Check whether a followed log file has been replaced by a new file with the same name
+    
+    :param f: file, the open log file
+    :param filename: str, file name of the log
+    :return: bool, True if filename now refers to another file, False if not or if there is no file right now
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    open_st = os.fstat(f.fileno())
+    return (st.st_ino, st.st_dev) != (open_st.st_ino, open_st.st_dev)
+
+
+def split_log_chunks(filename, chunk_size=PARSE_CHUNK_SIZE):
+    """
+    Split a log file into byte ranges of roughly chunk_size bytes, each range ends on a line boundary
+    
+    :param filename: str, file name as a string
+    :param chunk_size: int, approximate size of each chunk in bytes
+    :return: list, (start, end) byte offsets of the chunks, in file order
+    """
+    file_size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + chunk_size, file_size))
+            f.readline()  # move on to the end of the current line
+            end = f.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_log_chunk(filename, start, end, json_loads=json.loads):
+    """
+    Parse all the lines in a byte range of a log file, this runs in the worker processes of process_log_parallel()
+    
+    :param filename: str, file name as a string
+    :param start: int, offset of the first byte of the chunk, at the beginning of a line
+    :param end: int, offset just past the last byte of the chunk, at the end of a line
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :return: list, one event record per line of the chunk, None for lines that failed to parse
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).split(b'\n')
+    if not lines[-1]:  # the chunk ends with a newline, there is no line after it
+        lines.pop()
+
+    strings = dict()  # repeated ids and timestamps share one str object, so they are pickled only once
+    events = []
+    for line in lines:
+        try:
+            event = parse_log_line(line, json_loads)
+        except:
+            events.append(None)
             continue
-        network.process_log_entry(entry_dict)
+        if event[0] != EVENT_PARAMS and event[0] != EVENT_ILLEGAL:
+            event = (event[0],) + tuple([strings.setdefault(x, x) if type(x) is str else x for x in event[1:4]]) + \
+                event[4:]
+        events.append(event)
+    return events
+
+
+def process_log_parallel(filename, network, json_loads=json.loads, parse_workers=2, chunk_size=PARSE_CHUNK_SIZE):
+    """
+    Process either batch_log or stream_log, parsing and validating the lines in a pool of worker processes
+    The file is split into chunks on line boundaries, workers turn each chunk into a list of event records and
+    the events are applied to the network in log order in this process. At most 2 chunks per worker are in flight,
+    so memory usage does not depend on the size of the log
+    
+    :param filename: str, file name as a string
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :param parse_workers: int, number of worker processes
+    :param chunk_size: int, approximate size of each chunk in bytes
+    :return: void
+    """
+    print('processing {} with {} parse workers'.format(filename, parse_workers))
+    chunks = split_log_chunks(filename, chunk_size)
+    pool = multiprocessing.Pool(parse_workers)
+    try:
+        pending = collections.deque()
+        next_chunk = 0
+        i = 0  # line number
+        progress = tqdm(total=os.path.getsize(filename), unit='B', unit_scale=True)
+        while next_chunk < len(chunks) or pending:
+            # keep the workers busy, but bound the number of parsed chunks waiting to be applied
+            while next_chunk < len(chunks) and len(pending) < 2 * parse_workers:
+                start, end = chunks[next_chunk]
+                pending.append((end - start, pool.apply_async(parse_log_chunk, (filename, start, end, json_loads))))
+                next_chunk += 1
+
+            n_bytes, result = pending.popleft()
+            for event in result.get():
+                if event is None:
+                    print('failed to parse line {}, skip'.format(i))
+                else:
+                    network.process_event(event)
+                i += 1
+            progress.update(n_bytes)
+        progress.close()
+    finally:
+        pool.terminate()
+
+
+def convert_log_to_event_log(filename, event_log_file, json_loads=json.loads):
+    """
+    Convert a json log into a binary event log, so that it can be replayed without parsing json again
+    
+    The binary event log starts with EVENT_LOG_MAGIC and a byte order flag, followed by blocks of up to
+    EVENT_LOG_BLOCK_SIZE events. Each block has a header (number of events, number of new strings), the new entries
+    of the string table (their utf-8 lengths, then their utf-8 bytes), and the events stored by columns:
+        - code: uint8, EVENT_* code of the event, or EVENT_RAW_LINE
+        - seq: int64, line number of the event in the json log
+        - a, b, c: uint32, fields of the event, purchase: timestamp, id and amount as indexes in the string table;
+          befriend/unfriend: timestamp, id1 and id2 as indexes in the string table; params: D, T and unused;
+          raw line: index of the line in the string table
+        - amount: float64, purchase amount, 0 for other events
+    User ids, timestamps and amounts are interned in the string table, so each distinct value is stored only once.
+    Lines that don't convert into these columns (invalid json, illegal entries, unusual field types) are stored
+    verbatim as raw lines and parsed again on replay, so a replay behaves exactly like processing the json log
+    
+    :param filename: str, json log file name
+    :param event_log_file: str, binary event log file name
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :return: dict, a few statistics about the conversion
+    """
+    print('converting {} to {}'.format(filename, event_log_file))
+    strings = dict()  # string table, str -> index
+    stats = collections.Counter(events=0, raw_lines=0, strings=0)
+
+    with open(filename, 'rb', LOG_READ_BUFFER_SIZE) as f_in, open(event_log_file, 'wb') as f_out:
+        f_out.write(struct.pack(EVENT_LOG_HEADER_FORMAT, EVENT_LOG_MAGIC, sys.byteorder == 'big'))
+        block = _new_event_log_block()
+        new_strings = []
+
+        def intern(value):
+            index = strings.get(value)
+            if index is None:
+                encoded = value.encode('utf-8')
+                index = strings[value] = stats['strings']
+                stats['strings'] += 1
+                new_strings.append(encoded)
+            return index
+
+        for i, line in enumerate(tqdm(f_in, unit=' lines')):
+            codes, seqs, a, b, c, amounts = block
+            try:
+                event = parse_log_line(line, json_loads)
+                if event[0] == EVENT_PARAMS:
+                    a.append(event[1])
+                    b.append(event[2])
+                    c.append(0)
+                    amounts.append(0.)
+                elif event[0] != EVENT_ILLEGAL and type(event[1]) is str and type(event[2]) is str and \
+                        type(event[3]) is str:
+                    a.append(intern(event[1]))
+                    b.append(intern(event[2]))
+                    c.append(intern(event[3]))
+                    amounts.append(event[4] if event[0] == EVENT_PURCHASE else 0.)
+                else:
+                    raise ValueError('not a regular event')
+                codes.append(event[0])
+            except:  # parse failure, illegal entry, or a value that does not fit the columns
+                del a[len(codes):], b[len(codes):], c[len(codes):], amounts[len(codes):]
+                new_strings.append(line.rstrip(b'\r\n'))  # raw lines are not interned
+                a.append(stats['strings'])
+                stats['strings'] += 1
+                b.append(0)
+                c.append(0)
+                amounts.append(0.)
+                codes.append(EVENT_RAW_LINE)
+                stats['raw_lines'] += 1
+            seqs.append(i)
+            stats['events'] += 1
+
+            if len(codes) == EVENT_LOG_BLOCK_SIZE:
+                _write_event_log_block(f_out, block, new_strings)
+                block = _new_event_log_block()
+                new_strings = []
+        if block[0]:
+            _write_event_log_block(f_out, block, new_strings)
+
+        stats['json_bytes'] = f_in.tell()
+        stats['event_log_bytes'] = f_out.tell()
+
+    print('converted {events} lines ({raw_lines} raw lines), {strings} distinct strings, '
+          '{json_bytes} -> {event_log_bytes} bytes'.format(**stats))
+    return stats
+
+
+def _new_event_log_block():
+    """
+    :return: list, empty columns of a binary event log block: code, seq, a, b, c, amount
+    """
+    return [array.array('B'), array.array('q'), array.array('I'), array.array('I'), array.array('I'),
+            array.array('d')]
+
+
+def _write_event_log_block(f, block, new_strings):
+    """
+    Write one block of a binary event log, see convert_log_to_event_log() for the format
+    
+    :param f: file, binary event log opened for writing
+    :param block: list, columns of the block, see _new_event_log_block()
+    :param new_strings: list of bytes, utf-8 encoded strings added to the string table by this block
+    :return: void
+    """
+    f.write(struct.pack(EVENT_LOG_BLOCK_FORMAT, len(block[0]), len(new_strings)))
+    array.array('I', [len(x) for x in new_strings]).tofile(f)
+    f.write(b''.join(new_strings))
+    for column in block:
+        column.tofile(f)
+
+
+def is_regular_file(filename):
+    """
+    :param filename: str, file name as a string
+    :return: bool, True if filename is a regular file, False for a FIFO, a process substitution or a device, which can
+    only be read once from the start
+    """
+    return stat.S_ISREG(os.stat(filename).st_mode)
+
+
+def is_event_log(filename):
+    """
+    Check whether a file is a binary event log written by convert_log_to_event_log(), it must be a regular file as
+    its first bytes are read and the file is opened again afterwards, see is_regular_file()
+    
+    :param filename: str, file name as a string
+    :return: bool, True if the file starts with EVENT_LOG_MAGIC
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(EVENT_LOG_MAGIC)) == EVENT_LOG_MAGIC
+
+
+def process_event_log(filename, network, json_loads=json.loads):
+    """
+    Process either batch_log or stream_log converted into a binary event log, see convert_log_to_event_log()
+    Events are read block by block and applied to the network directly, only raw lines go through the parser
+    
+    :param filename: str, binary event log file name
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :return: void
+    """
+    print('processing {} (event log)'.format(filename))
+    strings = []  # string table, index -> str
+    with open(filename, 'rb', LOG_READ_BUFFER_SIZE) as f:
+        header = f.read(struct.calcsize(EVENT_LOG_HEADER_FORMAT))
+        magic, big_endian = struct.unpack(EVENT_LOG_HEADER_FORMAT, header)
+        if magic != EVENT_LOG_MAGIC:
+            raise ValueError('{} is not a binary event log'.format(filename))
+        swap_bytes = big_endian != (sys.byteorder == 'big')
+
+        progress = tqdm(total=os.path.getsize(filename), unit='B', unit_scale=True)
+        while True:
+            block_header = f.read(struct.calcsize(EVENT_LOG_BLOCK_FORMAT))
+            if not block_header:
+                break
+            n_events, n_strings = struct.unpack(EVENT_LOG_BLOCK_FORMAT, block_header)
+
+            lengths = _read_event_log_column(f, 'I', n_strings, swap_bytes)
+            data = f.read(sum(lengths))
+            start = 0
+            for length in lengths:
+                # raw lines are not always valid utf-8, surrogateescape gets their exact bytes back on replay
+                strings.append(data[start:start + length].decode('utf-8', 'surrogateescape'))
+                start += length
+
+            codes, seqs, a, b, c, amounts = [_read_event_log_column(f, typecode, n_events, swap_bytes)
+                                             for typecode in ('B', 'q', 'I', 'I', 'I', 'd')]
+            for code, seq, a_k, b_k, c_k, amount in zip(codes, seqs, a, b, c, amounts):
+                if code == EVENT_PURCHASE:
+                    network.process_event((EVENT_PURCHASE, strings[a_k], strings[b_k], strings[c_k], amount))
+                elif code == EVENT_BEFRIEND or code == EVENT_UNFRIEND:
+                    network.process_event((code, strings[a_k], strings[b_k], strings[c_k]))
+                elif code == EVENT_PARAMS:
+                    network.process_event((EVENT_PARAMS, a_k, b_k))
+                else:  # raw line
+                    try:
+                        event = parse_log_line(strings[a_k].encode('utf-8', 'surrogateescape'), json_loads)
+                    except:
+                        print('failed to parse line {}, skip'.format(seq))
+                        continue
+                    network.process_event(event)
+            progress.update(f.tell() - progress.n)
+        progress.close()
+
+
+def _read_event_log_column(f, typecode, n, swap_bytes):
+    """
+    Read one column of a binary event log block
+    
+    :param f: file, binary event log opened for reading
+    :param typecode: str, array typecode of the column
+    :param n: int, number of items in the column
+    :param swap_bytes: bool, whether the event log was written with the other byte order
+    :return: array, the column
+    """
+    column = array.array(typecode)
+    column.fromfile(f, n)
+    if swap_bytes:
+        column.byteswap()
+    return column
 
 
 def main():
-    if len(sys.argv) < 4:
+    parser = argparse.ArgumentParser(description='Flag anomalous purchases in a social network')
+    parser.add_argument('batch_log_file', nargs='?', help='log used to build the initial network, - for stdin')
+    parser.add_argument('stream_log_file', nargs='?', help='log of purchases to be checked for anomalies, - for stdin')
+    parser.add_argument('output_file', nargs='?', help='output file for flagged purchases')
+    parser.add_argument('--json-decoder', default='auto', choices=['auto'] + JSON_DECODERS,
+                        help='json backend used to parse log lines (default: fastest installed)')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep following stream_log like tail -F, flagged purchases are written as they are found')
+    parser.add_argument('--follow-timeout', type=float, default=None,
+                        help='with --follow, stop after this many seconds without new lines (default: follow forever)')
+    parser.add_argument('--export-network', metavar='FILE',
+                        help='once the logs are processed, write the network to FILE (e.g. in /dev/shm) for other '
+                             'processes to map read only, see shared_network.py')
+    parser.add_argument('--graph-store', default='dict', choices=sorted(GRAPH_STORES),
+                        help='graph representation, dict: list of dicts, csr: compact CSR arrays with a small mutable '
+                             'delta (default: dict)')
+    parser.add_argument('--purchase-store', default='ring', choices=sorted(PURCHASE_STORES),
+                        help='purchase history representation, ring: T slots per user, log: append-only log of all '
+                             'purchases with back pointers per user (default: ring)')
+    parser.add_argument('--mmap', action='store_true', help='read the logs through a memory map')
+    parser.add_argument('--neighborhood-cache-size', type=int, default=NEIGHBORHOOD_CACHE_SIZE,
+                        help='maximum number of users whose Dth degree network is cached, 0 disables the cache '
+                             '(default: {})'.format(NEIGHBORHOOD_CACHE_SIZE))
+    parser.add_argument('--network-views-size', type=int, default=NETWORK_VIEWS_SIZE,
+                        help='maximum number of users whose latest T network purchases are kept up to date, 0 '
+                             'disables them (default: {})'.format(NETWORK_VIEWS_SIZE))
+    parser.add_argument('--hop-index-max-entries', type=int, default=HOP_INDEX_MAX_ENTRIES,
+                        help='maximum size of the materialized Dth degree networks used for D=1 and D=2, 0 disables '
+                             'them (default: {})'.format(HOP_INDEX_MAX_ENTRIES))
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of processes the network is partitioned across (default: 1, not sharded)')
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help='number of processes parsing the logs in parallel (default: 1, parse in this process)')
+    args = parser.parse_args()
+
+    if args.output_file is None:
         debug = True
         sample_dir = 'sample_dataset'
         # sample_dir = 'sample2'
@@ -316,20 +1317,63 @@ def main():
 
     else:
         debug = False
-        batch_log_file = sys.argv[1]
-        stream_log_file = sys.argv[2]
-        output_file = sys.argv[3]
+        log_file = None
+        batch_log_file = args.batch_log_file
+        stream_log_file = args.stream_log_file
+        output_file = args.output_file
+
+    if batch_log_file == STDIN_LOG and stream_log_file == STDIN_LOG:
+        parser.error('only one of batch_log_file and stream_log_file can be read from stdin')
+    if args.shards > 1 and args.export_network:
+        parser.error('--export-network is not supported with --shards')
+    if args.shards > 1:  # the shards keep dict graphs and ring buffers, with no hop index, cache or views
+        for option in ('graph_store', 'purchase_store', 'neighborhood_cache_size', 'hop_index_max_entries',
+                       'network_views_size'):
+            if getattr(args, option) != parser.get_default(option):
+                parser.error('--{} is not supported with --shards'.format(option.replace('_', '-')))
+
+    json_loads = get_json_decoder(args.json_decoder)
 
     print('batch_log: {}'.format(batch_log_file))
     print('stream_log: {}'.format(stream_log_file))
     print('output_file: {}'.format(output_file))
+    print('json_decoder: {}'.format(json_loads.__module__))
 
     # initialize network
-    network = UserNetwork(debug_mode=debug)
+    if args.shards > 1:
+        from sharded_network import ShardedUserNetwork
+        network = ShardedUserNetwork(args.shards, debug_mode=debug)
+    else:
+        network = UserNetwork(debug_mode=debug, graph_store=args.graph_store,
+                              neighborhood_cache_size=args.neighborhood_cache_size,
+                              hop_index_max_entries=args.hop_index_max_entries,
+                              purchase_store=args.purchase_store,
+                              network_views_size=args.network_views_size)
+    try:
+        process_logs(args, network, batch_log_file, stream_log_file, output_file, json_loads, log_file)
+    finally:
+        if args.shards > 1:
+            network.close()
+
 
+def process_logs(args, network, batch_log_file, stream_log_file, output_file, json_loads, log_file):
+    """
+    Process batch_log then stream_log, see main()
+    
+    :param args: argparse.Namespace, command line arguments
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param batch_log_file: str, batch_log file name
+    :param stream_log_file: str, stream_log file name
+    :param output_file: str, output file name for flagged purchases
+    :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+    :param log_file: str, output file name for the debug log, only used in debug mode
+    :return: void
+    """
     # process batch_log
     network.do_flag_purchases = False
-    process_log(batch_log_file, network)
+    process_log(batch_log_file, network, json_loads, args.parse_workers, args.mmap)
+
+    network.network.compact()  # e.g. build the CSR base of the graph now that it is bootstrapped
 
     if network.debug_mode:
         network.debug_log(log_file)
@@ -337,11 +1381,28 @@ def main():
     # process stream log
     network.flagged_purchases = [] # force clean up flagged_purchases list
     network.do_flag_purchases = True
-    process_log(stream_log_file, network)
+    if args.follow:
+        with open(output_file, 'w') as f:
+            if stream_log_file == STDIN_LOG:
+                follow_stdin_log(network, f, json_loads)
+            else:
+                follow_log(stream_log_file, network, f, json_loads, idle_timeout=args.follow_timeout)
+        print(network.neighborhood_stats())
+        print('output to {}'.format(output_file))
+        if args.export_network:
+            export_network(network, args.export_network)
+            print('network exported to {}'.format(args.export_network))
+        return
+
+    process_log(stream_log_file, network, json_loads, args.parse_workers, args.mmap)
+    print(network.neighborhood_stats())
 
     with open(output_file, 'w') as f:
         f.write('\n'.join(network.flagged_purchases))
     print('output to {}'.format(output_file))
+    if args.export_network:
+        export_network(network, args.export_network)
+        print('network exported to {}'.format(args.export_network))
 
 
 if __name__ == "__main__":
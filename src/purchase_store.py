@@ -0,0 +1,325 @@
+from __future__ import print_function
+import array
+import heapq
+
+# minimum number of entries in a PurchaseLog before it is compacted, see PurchaseLog.append()
+PURCHASE_LOG_COMPACTION_MIN_ENTRIES = 65536
+
+
+class PurchaseHistories(object):
+    def __init__(self, T=2):
+        """
+        Columnar purchase histories of the latest T purchases of each user, in one arena of two arrays,
+        self.counters (log_entry_counter, array('q')) and self.amounts (purchase amount, array('d')), 16 bytes per
+        purchase instead of ~130 for a [log_entry_counter, amount] list in a deque, and no object per user
+        On their first purchase, user i gets a block of T slots starting at self.starts[i], used as a ring buffer:
+        their nth purchase (counting from 0) goes to slot n % T, and self.totals[i] counts their purchases so far, so
+        their kth latest purchase (k from 1 to min(self.totals[i], T)) is in slot (self.totals[i] - k) % T. Users with
+        no purchases only cost their start and total
+
+        :param T: int, number of purchases kept per user
+        """
+        self.T = T
+        self.counters = array.array('q')
+        self.amounts = array.array('d')
+        self.starts = array.array('q')  # item i is the first slot of user i's block, -1 before their first purchase
+        self.totals = array.array('q')  # item i is the number of purchases user i made
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add_user(self):
+        """
+        Append a user with no purchases, its user index is the previous len(self)
+
+        :return: void
+        """
+        self.starts.append(-1)
+        self.totals.append(0)
+
+    def append(self, user, log_entry_counter, amount):
+        """
+        :param user: int, user's index
+        :param log_entry_counter: int, counter of the purchase log entry, smaller than the counters of previous entries
+        :param amount: float, purchase amount
+        :return: void
+        """
+        T = self.T
+        if T <= 0:
+            return
+        start = self.starts[user]
+        if start < 0:  # first purchase, allocate user's block
+            start = self.starts[user] = len(self.counters)
+            self.counters.extend(array.array('q', [0]) * T)
+            self.amounts.extend(array.array('d', [0.]) * T)
+        total = self.totals[user]
+        self.counters[start + total % T] = log_entry_counter
+        self.amounts[start + total % T] = amount
+        self.totals[user] = total + 1
+
+    def n_purchases(self, user):
+        """
+        :param user: int, user's index
+        :return: int, number of purchases kept for user
+        """
+        return min(self.totals[user], self.T)
+
+    def latest(self, user):
+        """
+        :param user: int, user's index
+        :return: generator, (log_entry_counter, amount) of user's purchases, latest first
+        """
+        T = self.T
+        start = self.starts[user]
+        total = self.totals[user]
+        for k in range(1, min(total, T) + 1):
+            i = start + (total - k) % T
+            yield self.counters[i], self.amounts[i]
+
+    def history(self, user):
+        """
+        :param user: int, user's index
+        :return: list, (log_entry_counter, amount) of user's purchases, oldest first
+        """
+        history = list(self.latest(user))
+        history.reverse()
+        return history
+
+    def latest_purchases(self, users, T):
+        """
+        Heap merge of the purchase histories of some users, read in place from the arena
+
+        :param users: iterable, user indexes
+        :param T: int, maximum number of purchases returned
+        :return: list, (log_entry_counter, amount) of the latest T purchases of users, latest first
+        """
+        counters = self.counters
+        starts = self.starts
+        totals = self.totals
+        size = self.T  # size of the ring buffers
+        # heap items are (log_entry_counter, user, k) for user's kth latest purchase, counters are unique so users and
+        # k are never compared
+        heap = [(counters[starts[user] + (totals[user] - 1) % size], user, 1) for user in users if totals[user]]
+        heapq.heapify(heap)
+
+        purchases = []
+        while heap:
+            log_entry_counter, user, k = heap[0]
+            start = starts[user]
+            total = totals[user]
+            purchases.append((log_entry_counter, self.amounts[start + (total - k) % size]))
+            if len(purchases) == T:
+                break
+            if k < total and k < size:
+                heapq.heapreplace(heap, (counters[start + (total - k - 1) % size], user, k + 1))
+            else:
+                heapq.heappop(heap)
+        return purchases
+
+    def resize(self, T):
+        """
+        Keep the latest T purchases of each user from now on, each user's kept purchases are copied to a new block of
+        T slots, see UserNetwork.resize_purchase_histories()
+
+        :param T: int, number of purchases kept per user
+        :return: void
+        """
+        histories = [self.history(user)[-T:] if T > 0 else [] for user in range(len(self))]
+        self.T = T
+        self.counters = array.array('q')
+        self.amounts = array.array('d')
+        self.starts = array.array('q', [-1]) * len(histories)
+        self.totals = array.array('q', [0]) * len(histories)
+        for user, history in enumerate(histories):
+            for log_entry_counter, amount in history:
+                self.append(user, log_entry_counter, amount)
+
+    def snapshot(self):
+        """
+        :return: PurchaseHistories, read only copy of the histories, not affected by later purchases
+        """
+        snapshot = PurchaseHistories(self.T)
+        snapshot.counters = self.counters[:]
+        snapshot.amounts = self.amounts[:]
+        snapshot.starts = self.starts[:]
+        snapshot.totals = self.totals[:]
+        return snapshot
+
+    def memory_usage(self):
+        """
+        :return: int, approximate number of bytes used by the histories
+        """
+        return 8 * (len(self.counters) + len(self.amounts) + len(self.starts) + len(self.totals))
+
+
+class PurchaseLog(object):
+    def __init__(self, T=2, compaction_min_entries=PURCHASE_LOG_COMPACTION_MIN_ENTRIES):
+        """
+        Purchase histories in one append-only log of parallel arrays, entry j is a purchase of user self.users[j]
+        with counter self.counters[j] and amount self.amounts[j], self.previous[j] is the entry of the same user's
+        previous purchase (-1 for their first), and self.heads[i] is the entry of user i's latest purchase (-1 before
+        it); a user's history is read by following the back pointers from their head, at most T entries deep. There
+        is no object per user or per purchase, entries are in log order, and snapshot() is a copy of the arrays
+        Entries more than T purchases behind their user's head are never read again, the log is compacted (the entries
+        still needed are copied to new arrays, in the same order) once it is over compaction_min_entries and half of
+        it is such garbage, so memory stays O(users x T) like PurchaseHistories
+
+        :param T: int, number of purchases read per user
+        :param compaction_min_entries: int, minimum number of entries before the log is compacted
+        """
+        self.T = T
+        self.compaction_min_entries = compaction_min_entries
+        self.users = array.array('i')
+        self.counters = array.array('q')
+        self.amounts = array.array('d')
+        self.previous = array.array('q')
+        self.heads = array.array('q')  # item i is the entry of user i's latest purchase, -1 before their first
+        self.lengths = array.array('q')  # item i is the number of entries of user i in the log
+        self.n_kept = 0  # number of entries at most T purchases behind their user's head
+        self.n_compactions = 0
+
+    def __len__(self):
+        return len(self.heads)
+
+    def add_user(self):
+        """
+        Append a user with no purchases, its user index is the previous len(self)
+
+        :return: void
+        """
+        self.heads.append(-1)
+        self.lengths.append(0)
+
+    def append(self, user, log_entry_counter, amount):
+        """
+        :param user: int, user's index
+        :param log_entry_counter: int, counter of the purchase log entry, smaller than the counters of previous entries
+        :param amount: float, purchase amount
+        :return: void
+        """
+        if self.T <= 0:
+            return
+        self.users.append(user)
+        self.counters.append(log_entry_counter)
+        self.amounts.append(amount)
+        self.previous.append(self.heads[user])
+        self.heads[user] = len(self.counters) - 1
+        if self.lengths[user] < self.T:
+            self.n_kept += 1
+        self.lengths[user] += 1
+        if len(self.counters) >= self.compaction_min_entries and len(self.counters) >= 2 * self.n_kept:
+            self.compact(self.T)
+
+    def n_purchases(self, user):
+        """
+        :param user: int, user's index
+        :return: int, number of purchases kept for user
+        """
+        return min(self.lengths[user], self.T)
+
+    def latest(self, user):
+        """
+        :param user: int, user's index
+        :return: generator, (log_entry_counter, amount) of user's purchases, latest first
+        """
+        entry = self.heads[user]
+        for _ in range(self.n_purchases(user)):
+            yield self.counters[entry], self.amounts[entry]
+            entry = self.previous[entry]
+
+    def history(self, user):
+        """
+        :param user: int, user's index
+        :return: list, (log_entry_counter, amount) of user's purchases, oldest first
+        """
+        history = list(self.latest(user))
+        history.reverse()
+        return history
+
+    def latest_purchases(self, users, T):
+        """
+        Heap merge of the purchase histories of some users, walking the back pointers of the log
+
+        :param users: iterable, user indexes
+        :param T: int, maximum number of purchases returned
+        :return: list, (log_entry_counter, amount) of the latest T purchases of users, latest first
+        """
+        counters = self.counters
+        previous = self.previous
+        heads = self.heads
+        # heap items are (log_entry_counter, entry, k) for user's kth latest purchase, counters are unique so entries
+        # and k are never compared
+        heap = [(counters[heads[user]], heads[user], self.n_purchases(user)) for user in users if heads[user] >= 0]
+        heapq.heapify(heap)
+
+        purchases = []
+        while heap:
+            log_entry_counter, entry, n_left = heap[0]
+            purchases.append((log_entry_counter, self.amounts[entry]))
+            if len(purchases) == T:
+                break
+            if n_left > 1:
+                entry = previous[entry]
+                heapq.heapreplace(heap, (counters[entry], entry, n_left - 1))
+            else:
+                heapq.heappop(heap)
+        return purchases
+
+    def compact(self, T):
+        """
+        Copy the latest T purchases of each user to new arrays, in log order
+
+        :param T: int, number of purchases kept per user
+        :return: void
+        """
+        keep = bytearray(len(self.counters))
+        for user in range(len(self.heads)):
+            entry = self.heads[user]
+            for _ in range(min(self.lengths[user], T)):
+                keep[entry] = 1
+                entry = self.previous[entry]
+
+        users, counters, amounts, previous = self.users, self.counters, self.amounts, self.previous
+        self.users = array.array('i')
+        self.counters = array.array('q')
+        self.amounts = array.array('d')
+        self.previous = array.array('q')
+        self.heads = array.array('q', [-1]) * len(self.heads)
+        self.lengths = array.array('q', [0]) * len(self.heads)
+        self.n_kept = 0
+        T, self.T = self.T, T  # append() keeps the first T purchases of each user
+        for entry in range(len(keep)):
+            if keep[entry]:
+                self.append(users[entry], counters[entry], amounts[entry])
+        self.T = T
+        self.n_compactions += 1
+
+    def resize(self, T):
+        """
+        Keep the latest T purchases of each user from now on, the log is compacted so purchases more than the previous
+        T behind are dropped as in PurchaseHistories, see UserNetwork.resize_purchase_histories()
+
+        :param T: int, number of purchases kept per user
+        :return: void
+        """
+        self.compact(min(self.T, T) if T > 0 else 0)
+        self.T = T
+
+    def snapshot(self):
+        """
+        :return: PurchaseLog, read only copy of the log, not affected by later purchases
+        """
+        snapshot = PurchaseLog(self.T, self.compaction_min_entries)
+        for name in ('users', 'counters', 'amounts', 'previous', 'heads', 'lengths'):
+            setattr(snapshot, name, getattr(self, name)[:])
+        snapshot.n_kept = self.n_kept
+        return snapshot
+
+    def memory_usage(self):
+        """
+        :return: int, approximate number of bytes used by the log
+        """
+        return 28 * len(self.counters) + 16 * len(self.heads)
+
+
+PURCHASE_STORES = {'ring': PurchaseHistories, 'log': PurchaseLog}
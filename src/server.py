@@ -0,0 +1,278 @@
+from __future__ import print_function
+import argparse
+import asyncio
+import sys
+import os
+
+from process_log import UserNetwork, JSON_DECODERS, get_json_decoder, parse_log_line, process_log
+from graph_store import GRAPH_STORES
+from purchase_store import PURCHASE_STORES
+
+# first line sent by a client to receive flagged purchases instead of sending events
+SUBSCRIBE_COMMAND = b'SUBSCRIBE'
+
+# maximum number of received lines waiting to be processed; when full, producers are not read from until there is room
+EVENT_QUEUE_SIZE = 10000
+
+# maximum number of flagged purchases waiting to be sent to one subscriber; subscribers falling further behind are
+# disconnected
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+# maximum length of one log line
+MAX_LINE_LENGTH = 1 << 16
+
+
+class AnomalyServer(object):
+    def __init__(self, network, json_loads, output=None):
+        """
+        Server accepting newline delimited log entries from many concurrent producers, and streaming flagged purchases
+        back to subscribers. All entries go through a single bounded queue and are applied to the network in arrival
+        order by one consumer task, so the network is only ever modified by one task
+
+        :param network: UserNetwork, an instance of UserNetwork class, usually built from batch_log
+        :param json_loads: function, decodes a log line (bytes) into a dictionary, see get_json_decoder()
+        :param output: file, optional text file flagged purchases are also appended to, one per line
+        """
+        self.network = network
+        self.network.do_flag_purchases = True
+        self.json_loads = json_loads
+        self.output = output
+
+        self.events = None  # raw lines in arrival order, an asyncio.Queue created by serve() in the running event loop
+        self.subscribers = set()  # one queue of flagged purchases per subscriber
+        self.log_entry_counter = 0  # line number across all producers
+
+    async def handle_connection(self, reader, writer):
+        """
+        Connection handler, the first line decides whether the client is a subscriber or a producer
+
+        :param reader: asyncio.StreamReader, reading from the client
+        :param writer: asyncio.StreamWriter, writing to the client
+        :return: void
+        """
+        try:
+            first_line = await reader.readline()
+            if first_line.strip() == SUBSCRIBE_COMMAND:
+                await self.serve_subscriber(writer)
+            elif first_line:
+                await self.events.put(first_line)
+                await self.serve_producer(reader)
+        except (ValueError, ConnectionError) as e:  # line too long, or connection lost
+            print('closing connection: {}'.format(e))
+        finally:
+            writer.close()
+
+    async def serve_producer(self, reader):
+        """
+        Read log lines from a producer into the event queue until it disconnects
+        When the queue is full, the producer is not read from, and flow control eventually blocks the producer
+
+        :param reader: asyncio.StreamReader, reading from the producer
+        :return: void
+        """
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            await self.events.put(line)
+
+    async def serve_subscriber(self, writer):
+        """
+        Send flagged purchases to a subscriber, one per line, until it disconnects or falls too far behind
+
+        :param writer: asyncio.StreamWriter, writing to the subscriber
+        :return: void
+        """
+        flagged_purchases = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(flagged_purchases)
+        try:
+            while True:
+                flagged_purchase = await flagged_purchases.get()
+                if flagged_purchase is None:  # dropped by publish()
+                    print('subscriber too slow, disconnect')
+                    break
+                writer.write(flagged_purchase.encode('utf-8') + b'\n')
+                await writer.drain()
+        finally:
+            self.subscribers.discard(flagged_purchases)
+
+    def publish(self, flagged_purchase):
+        """
+        Queue a flagged purchase for every subscriber, subscribers whose queue is full are dropped
+
+        :param flagged_purchase: str, flagged purchase in the output format
+        :return: void
+        """
+        if self.output is not None:
+            self.output.write(flagged_purchase + '\n')
+            self.output.flush()
+        for flagged_purchases in list(self.subscribers):
+            try:
+                flagged_purchases.put_nowait(flagged_purchase)
+            except asyncio.QueueFull:
+                self.subscribers.discard(flagged_purchases)
+                flagged_purchases.get_nowait()  # make room for the disconnect signal
+                flagged_purchases.put_nowait(None)
+
+    async def process_events(self):
+        """
+        Consumer task, applies the received lines to the network one at a time, in arrival order
+
+        :return: void
+        """
+        network = self.network
+        while True:
+            line = await self.events.get()
+            try:
+                event = parse_log_line(line, self.json_loads)
+            except:
+                print('failed to parse line {}, skip'.format(self.log_entry_counter))
+            else:
+                try:
+                    network.process_event(event)
+                    for flagged_purchase in network.flagged_purchases:
+                        self.publish(flagged_purchase)
+                except Exception as e:  # keep consuming, otherwise producers block on the full queue forever
+                    print('failed to process line {}: {!r}, skip'.format(self.log_entry_counter, e))
+                finally:
+                    del network.flagged_purchases[:]
+            self.log_entry_counter += 1
+
+
+def parse_address(address):
+    """
+    :param address: str, either HOST:PORT for TCP or unix:PATH for a Unix socket
+    :return: tuple, ('tcp', host, port) or ('unix', path, None)
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):], None
+    host, _, port = address.rpartition(':')
+    return 'tcp', host or '127.0.0.1', int(port)
+
+
+async def open_connection(address):
+    """
+    :param address: str, server address, see parse_address()
+    :return: tuple, (asyncio.StreamReader, asyncio.StreamWriter) connected to the server
+    """
+    kind, host_or_path, port = parse_address(address)
+    if kind == 'unix':
+        return await asyncio.open_unix_connection(host_or_path)
+    return await asyncio.open_connection(host_or_path, port)
+
+
+async def serve(server, address):
+    """
+    Run the server until cancelled
+
+    :param server: AnomalyServer, the server state
+    :param address: str, address to listen on, see parse_address()
+    :return: void
+    """
+    kind, host_or_path, port = parse_address(address)
+    server.events = asyncio.Queue(EVENT_QUEUE_SIZE)  # bound to the running loop before python 3.10
+    if kind == 'unix':
+        listener = await asyncio.start_unix_server(server.handle_connection, host_or_path, limit=MAX_LINE_LENGTH)
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host_or_path, port, limit=MAX_LINE_LENGTH)
+    print('listening on {}'.format(address))
+
+    consumer = asyncio.ensure_future(server.process_events())
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        consumer.cancel()
+        if kind == 'unix' and os.path.exists(host_or_path):
+            os.remove(host_or_path)
+
+
+async def send_log(address, filename):
+    """
+    Client sending a log file to the server, line by line
+
+    :param address: str, server address, see parse_address()
+    :param filename: str, log file name, '-' for stdin
+    :return: void
+    """
+    reader, writer = await open_connection(address)
+    f = sys.stdin.buffer if filename == '-' else open(filename, 'rb')
+    try:
+        for line in f:
+            writer.write(line if line.endswith(b'\n') else line + b'\n')
+            await writer.drain()
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+        writer.close()
+        await writer.wait_closed()
+
+
+async def subscribe(address, output):
+    """
+    Client receiving flagged purchases from the server until it disconnects
+
+    :param address: str, server address, see parse_address()
+    :param output: file, text file the flagged purchases are written to, one per line
+    :return: void
+    """
+    reader, writer = await open_connection(address)
+    writer.write(SUBSCRIBE_COMMAND + b'\n')
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        output.write(line.decode('utf-8'))
+        output.flush()
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Anomaly detection server for newline delimited json events, and '
+                                                 'local clients to send events and receive flagged purchases')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve_parser = subparsers.add_parser('serve', help='run the server')
+    serve_parser.add_argument('batch_log_file', help='log used to build the initial network')
+    serve_parser.add_argument('address', help='address to listen on, HOST:PORT or unix:PATH')
+    serve_parser.add_argument('--output', help='file flagged purchases are also appended to')
+    serve_parser.add_argument('--json-decoder', default='auto', choices=['auto'] + JSON_DECODERS,
+                              help='json backend used to parse log lines (default: fastest installed)')
+    serve_parser.add_argument('--graph-store', default='dict', choices=sorted(GRAPH_STORES),
+                              help='graph representation, dict or csr (default: dict)')
+    serve_parser.add_argument('--purchase-store', default='ring', choices=sorted(PURCHASE_STORES),
+                              help='purchase history representation, ring or log (default: ring)')
+
+    send_parser = subparsers.add_parser('send', help='send a log to the server')
+    send_parser.add_argument('address', help='server address, HOST:PORT or unix:PATH')
+    send_parser.add_argument('log_file', help='log to send, - for stdin')
+
+    subscribe_parser = subparsers.add_parser('subscribe', help='print flagged purchases sent by the server')
+    subscribe_parser.add_argument('address', help='server address, HOST:PORT or unix:PATH')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'serve':
+            json_loads = get_json_decoder(args.json_decoder)
+            network = UserNetwork(graph_store=args.graph_store, purchase_store=args.purchase_store)
+            process_log(args.batch_log_file, network, json_loads)
+            network.network.compact()
+            output = open(args.output, 'a') if args.output else None
+            try:
+                asyncio.run(serve(AnomalyServer(network, json_loads, output), args.address))
+            finally:
+                if output is not None:
+                    output.close()
+        elif args.command == 'send':
+            asyncio.run(send_log(args.address, args.log_file))
+        elif args.command == 'subscribe':
+            asyncio.run(subscribe(args.address, sys.stdout))
+        else:
+            parser.print_help()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
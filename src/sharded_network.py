@@ -0,0 +1,326 @@
+from __future__ import print_function
+import multiprocessing
+import heapq
+import time
+
+from process_log import UserNetwork
+from purchase_store import PurchaseHistories
+
+# commands sent to the shards, see run_shard()
+SHARD_BEFRIEND = 0  # (SHARD_BEFRIEND, user, friend)
+SHARD_UNFRIEND = 1  # (SHARD_UNFRIEND, user, friend)
+SHARD_PURCHASE = 2  # (SHARD_PURCHASE, user, log_entry_counter, amount)
+SHARD_FRIENDS = 3  # (SHARD_FRIENDS, user, D), replies with the shard's part of user's Dth degree network
+SHARD_RECENT = 4  # (SHARD_RECENT, user, D, T), replies with the size of the shard's part of user's Dth degree network
+# and the T latest purchases in it
+SHARD_RESIZE = 5  # (SHARD_RESIZE, T), resizes the purchase histories, see UserNetwork.resize_purchase_histories()
+SHARD_STOP = 6  # (SHARD_STOP,)
+
+# maximum number of buffered commands per shard, they are sent as one message
+SHARD_BATCH_SIZE = 4096
+
+
+class ShardedUserNetwork(UserNetwork):
+    def __init__(self, shards=2, D=1, T=2, do_flag_purchases=False, debug_mode=False):
+        """
+        UserNetwork partitioned across worker processes, each shard owns the connections and purchase histories of the
+        users whose index is equal to its number modulo the number of shards. This process interns the user ids and
+        routes each event to the shards owning its users. For a purchase to be checked, every shard gets one query
+        and the shards search user's Dth degree network together, see search_network(): each shard expands the part
+        of the frontier it owns and sends the new friends owned by other shards straight to them, so this process only
+        merges the latest T purchases of each shard's part of the network. Flagged purchases are identical to
+        UserNetwork
+
+        Commands without a reply are buffered per shard and sent SHARD_BATCH_SIZE at a time, or before a query to
+        the shard, so each shard applies its commands in log order
+
+        :param shards: int, number of worker processes
+        :param D: int, specifies Dth degree connections to be included in user's network
+        :param T: int, specifies T recent purchases in network to be considered for anomaly detection
+        :param do_flag_purchases: bool, specifies whether to flag anomalous purchase
+        :param debug_mode: bool, specifies whether in debug mode, in debug mode a few more lists will be populated
+        """
+        # the graph and purchases live in the shards, UserNetwork's own structures stay empty
+        super(ShardedUserNetwork, self).__init__(D, T, do_flag_purchases, debug_mode, neighborhood_cache_size=0,
+                                                 hop_index_max_entries=0, network_views_size=0)
+        self.connections = []  # this process' end of the pipe of each shard
+        self.processes = []
+        self.buffers = []  # commands waiting to be sent to each shard
+        inboxes = [multiprocessing.Queue() for _ in range(shards)]  # frontiers sent between shards, see run_shard()
+        for shard in range(shards):
+            connection, shard_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_shard, args=(shard_connection, shard, inboxes))
+            process.daemon = True
+            process.start()
+            shard_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+            self.buffers.append([])
+        self.resize_purchase_histories()
+
+    def intern_user(self, user_id):
+        """
+        Helper function mapping a user id to its user index, if user is new, a new index is assigned, the shard
+        owning user is user index % number of shards
+        :param user_id: str, user's id from log entry
+        :return: int, user index
+        """
+        user = self.user_ids.get(user_id)
+        if user is None:  # user is new
+            user = self.user_ids[user_id] = len(self.user_names)
+            self.user_names.append(user_id)
+        return user
+
+    def send(self, shard, command):
+        """
+        Buffer a command for a shard, the buffer is sent once full
+
+        :param shard: int, shard number
+        :param command: tuple, one of the SHARD_* commands
+        :return: void
+        """
+        buffer = self.buffers[shard]
+        buffer.append(command)
+        if len(buffer) >= SHARD_BATCH_SIZE:
+            self.connections[shard].send(buffer)
+            self.buffers[shard] = []
+
+    def query(self, command):
+        """
+        Send a query to every shard, after their buffered commands, and wait for the replies
+
+        :param command: tuple, SHARD_FRIENDS or SHARD_RECENT command
+        :return: list, the reply of each shard
+        """
+        for shard, connection in enumerate(self.connections):
+            buffer = self.buffers[shard]
+            buffer.append(command)
+            connection.send(buffer)
+            self.buffers[shard] = []
+        return [connection.recv() for connection in self.connections]
+
+    def resize_purchase_histories(self):
+        """
+        Helper function resizing the purchase histories kept by the shards to the current T, see
+        UserNetwork.resize_purchase_histories()
+
+        :return: void
+        """
+        for shard in range(len(self.connections)):
+            self.send(shard, (SHARD_RESIZE, self.T))
+
+    def add_connection(self, event):
+        """
+        Function to handle befriend activities, each user's shard records the connection
+
+        :param event: tuple, befriend event record (EVENT_BEFRIEND, timestamp, id1, id2)
+        :return: void
+        """
+        p1 = self.intern_user(event[2])
+        p2 = self.intern_user(event[3])
+        shards = len(self.connections)
+        self.send(p1 % shards, (SHARD_BEFRIEND, p1, p2))
+        self.send(p2 % shards, (SHARD_BEFRIEND, p2, p1))
+
+    def remove_connection(self, event):
+        """
+        Function to handle unfriend activities, each user's shard removes the connection if it exists
+
+        :param event: tuple, unfriend event record (EVENT_UNFRIEND, timestamp, id1, id2)
+        :return: void
+        """
+        p1 = self.user_ids.get(event[2])
+        p2 = self.user_ids.get(event[3])
+        if p1 is not None and p2 is not None:
+            shards = len(self.connections)
+            self.send(p1 % shards, (SHARD_UNFRIEND, p1, p2))
+            self.send(p2 % shards, (SHARD_UNFRIEND, p2, p1))
+
+    def add_purchase(self, event):
+        """
+        Function to handle purchase entries, see UserNetwork.add_purchase()
+        The purchase is recorded by user's shard, then if self.do_flag_purchases == True, the latest T purchases of
+        each shard's part of user's Dth degree network are merged, latest first as in UserNetwork; the network itself
+        never leaves the shards
+        :param event: tuple, purchase event record (EVENT_PURCHASE, timestamp, id, amount, amount as float)
+        :return: void
+        """
+        purchase_amount = event[4]
+        user = self.intern_user(event[2])
+        shards = len(self.connections)
+        self.send(user % shards, (SHARD_PURCHASE, user, self.log_entry_counter, purchase_amount))
+        self.log_entry_counter -= 1
+
+        if not self.do_flag_purchases:  # stops here if no need to flag purchases
+            return
+
+        start_time = time.time()
+        replies = self.query((SHARD_RECENT, user, self.D, self.T))
+        if self.debug_mode:
+            self.find_friends_time_log.append(time.time() - start_time)
+            self.n_friends_log.append(sum(n_friends for n_friends, _ in replies))
+
+        start_time = time.time()
+        recent_purchases = []
+        for log_entry_counter, amount in heapq.merge(*[purchases for _, purchases in replies]):
+            recent_purchases.append(amount)
+            if len(recent_purchases) == self.T:
+                break
+        if self.debug_mode:
+            self.merge_time_log.append(time.time() - start_time)
+
+        # check if purchase should be flagged
+        if len(recent_purchases) >= 2:
+            self.flag_purchase(recent_purchases, purchase_amount, event)
+
+    def find_friends(self, user):
+        """
+        Function to find all the friends in user's Dth degree network, searched by the shards, see search_network()
+
+        :param user: int, user's index
+        :return: list, user indexes of the friends in user's Dth degree network
+        """
+        connected_users = []
+        for friends in self.query((SHARD_FRIENDS, user, self.D)):
+            connected_users.extend(friends)
+        return connected_users
+
+    def neighborhood_stats(self):
+        """
+        :return: str, number of shards and of users
+        """
+        return '{} users sharded across {} processes'.format(len(self.user_names), len(self.connections))
+
+    def close(self):
+        """
+        Stop the shard processes
+
+        :return: void
+        """
+        for shard, connection in enumerate(self.connections):
+            connection.send(self.buffers[shard] + [(SHARD_STOP,)])
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+
+def run_shard(connection, shard, inboxes):
+    """
+    Shard process main loop, applies the lists of commands received from ShardedUserNetwork in order, and sends back
+    one reply for a list ending with a query
+    The shard stores the connections (dict of friend index -> multiplicity, as in graph_store.AdjacencyGraph) and
+    latest T purchases (purchase_store.PurchaseHistories, as in UserNetwork) of the users it owns, which are indexed
+    by user index // n_shards there
+
+    :param connection: multiprocessing.Connection, pipe to ShardedUserNetwork
+    :param shard: int, shard number
+    :param inboxes: list, one multiprocessing.Queue per shard, receiving the frontiers sent by the other shards
+    :return: void
+    """
+    n_shards = len(inboxes)
+    rows = dict()  # user index -> dict of friend index -> multiplicity
+    own_purchases = PurchaseHistories()  # indexed by user index // number of shards, T is set by the first SHARD_RESIZE
+    search = ShardSearch(shard, inboxes, rows)
+    while True:
+        for command in connection.recv():
+            code = command[0]
+            if code == SHARD_PURCHASE:
+                user = command[1] // n_shards
+                while len(own_purchases) <= user:
+                    own_purchases.add_user()
+                own_purchases.append(user, command[2], command[3])
+
+            elif code == SHARD_BEFRIEND:
+                row = rows.setdefault(command[1], dict())
+                row[command[2]] = row.get(command[2], 0) + 1
+
+            elif code == SHARD_UNFRIEND:
+                row = rows.get(command[1])
+                if row is not None and command[2] in row:
+                    if row[command[2]] > 1:
+                        row[command[2]] -= 1
+                    else:
+                        del row[command[2]]
+
+            elif code == SHARD_RECENT:
+                # latest T purchases of the shard's part of the network, latest (most negative log_entry_counter) first
+                friends = search.search_network(command[1], command[2])
+                users = [user // n_shards for user in friends if user // n_shards < len(own_purchases)]
+                connection.send((len(friends), own_purchases.latest_purchases(users, command[3])))
+
+            elif code == SHARD_FRIENDS:
+                connection.send(search.search_network(command[1], command[2]))
+
+            elif code == SHARD_RESIZE:
+                own_purchases.resize(command[1])
+
+            else:  # SHARD_STOP
+                return
+
+
+class ShardSearch(object):
+    def __init__(self, shard, inboxes, rows):
+        """
+        One shard's side of the breadth first searches run by all the shards together, see search_network()
+
+        :param shard: int, shard number
+        :param inboxes: list, one multiprocessing.Queue per shard, receiving the frontiers sent by the other shards
+        :param rows: dict, user index -> dict of friend index -> multiplicity, connections of the users the shard owns
+        """
+        self.shard = shard
+        self.inboxes = inboxes
+        self.rows = rows
+        self.pending = dict()  # hop -> frontiers received early from shards already at that hop
+
+    def search_network(self, user, D):
+        """
+        The shard's part of user's Dth degree network, all the shards run this for the same query at the same time
+        At each hop, the shard expands the part of the frontier it owns, then sends each other shard the set of the
+        friends it found that the other shard owns (possibly empty, so every shard knows when it has heard from all
+        the others), and receives theirs; the friends it owns and had not visited during this query are its part of
+        the next frontier. Visited users and duplicates never leave the shards, only one set per pair of shards and
+        per hop is sent
+
+        :param user: int, user's index
+        :param D: int, degree of the network
+        :return: list, user indexes of the friends in user's Dth degree network owned by the shard
+        """
+        shard = self.shard
+        n_shards = len(self.inboxes)
+        rows = self.rows
+        visited = {user} if user % n_shards == shard else set()
+        front = list(visited)
+        reached = []
+        for hop in range(D):
+            found = [set() for _ in range(n_shards)]  # item i is the set of friends found owned by shard i
+            for u in front:
+                row = rows.get(u)
+                if row:
+                    for friend in row:
+                        found[friend % n_shards].add(friend)
+            for other in range(n_shards):
+                if other != shard:
+                    self.inboxes[other].put((hop, found[other]))
+            candidates = found[shard]
+            for _ in range(n_shards - 1):
+                candidates |= self.receive(hop)
+            front = [friend for friend in candidates if friend not in visited]
+            visited.update(front)
+            reached.extend(front)
+        return reached
+
+    def receive(self, hop):
+        """
+        :param hop: int, current hop of the search
+        :return: set, a frontier sent by another shard for this hop; frontiers of the next hop, sent by shards that
+        are already there, are kept for later
+        """
+        pending = self.pending.get(hop)
+        if pending:
+            return pending.pop()
+        inbox = self.inboxes[self.shard]
+        while True:
+            message_hop, friends = inbox.get()
+            if message_hop == hop:
+                return friends
+            self.pending.setdefault(message_hop, []).append(friends)
@@ -0,0 +1,131 @@
+from __future__ import print_function
+import struct
+import array
+import mmap
+
+# file layout: header, then the sections below in this order, each padded to a multiple of 8 bytes
+SHARED_NETWORK_MAGIC = b'NETSNAP1'
+SHARED_NETWORK_HEADER_FORMAT = '<8sqqqqqq'  # magic, D, T, n_users, n_connections, n_purchases, n_name_bytes
+SHARED_NETWORK_SECTIONS = [  # name, array type code
+    ('offsets', 'q'), ('friends', 'i'), ('multiplicities', 'I'),
+    ('purchase_offsets', 'q'), ('purchase_counters', 'q'), ('purchase_amounts', 'd'),
+    ('name_offsets', 'q'), ('names', 'B'),
+]
+
+
+def export_network(network, filename):
+    """
+    Write a read only snapshot of a UserNetwork (graph, purchase histories and user ids) to a file that any number of
+    processes can map with SharedNetwork without copying or unpickling it; put it in /dev/shm to keep it in memory
+    The graph is stored as CSR arrays (see graph_store.CompactGraph), user i's purchases as
+    purchase_counters/purchase_amounts[purchase_offsets[i]:purchase_offsets[i + 1]], oldest first, and user i's id
+    as names[name_offsets[i]:name_offsets[i + 1]] in utf-8. Arrays are in native byte order, for readers on the same
+    machine
+
+    :param network: UserNetwork, an instance of UserNetwork class
+    :param filename: str, output file name
+    :return: void
+    """
+    graph = network.network.snapshot()
+
+    purchase_offsets = array.array('q', [0])
+    purchase_counters = array.array('q')
+    purchase_amounts = array.array('d')
+    for user in range(len(network.own_purchases)):
+        for log_entry_counter, amount in network.own_purchases.history(user):
+            purchase_counters.append(log_entry_counter)
+            purchase_amounts.append(amount)
+        purchase_offsets.append(len(purchase_counters))
+
+    name_offsets = array.array('q', [0])
+    names = bytearray()
+    for user_id in network.user_names:
+        names += user_id.encode('utf-8')
+        name_offsets.append(len(names))
+
+    sections = [graph.offsets, graph.friends, graph.multiplicities, purchase_offsets, purchase_counters,
+                purchase_amounts, name_offsets, names]
+    with open(filename, 'wb') as f:
+        f.write(struct.pack(SHARED_NETWORK_HEADER_FORMAT, SHARED_NETWORK_MAGIC, network.D, network.T,
+                            len(network.user_names), len(graph.friends), len(purchase_counters), len(names)))
+        for section in sections:
+            data = memoryview(section).cast('B')
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+
+
+class SharedNetwork(object):
+    def __init__(self, filename):
+        """
+        Read only view of a network written by export_network(), mapped into memory, so processes opening the same
+        file share one copy of it
+        self can be searched like a graph store, e.g. with graph_search.BreadthFirstSearch(SharedNetwork(filename))
+
+        :param filename: str, file written by export_network()
+        """
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = buf = memoryview(self.map)
+
+        header_size = struct.calcsize(SHARED_NETWORK_HEADER_FORMAT)
+        magic, self.D, self.T, n_users, n_connections, n_purchases, n_name_bytes = struct.unpack(
+            SHARED_NETWORK_HEADER_FORMAT, buf[:header_size])
+        if magic != SHARED_NETWORK_MAGIC:
+            raise ValueError('{} is not a network snapshot'.format(filename))
+
+        lengths = [n_users + 1, n_connections, n_connections, n_users + 1, n_purchases, n_purchases, n_users + 1,
+                   n_name_bytes]
+        position = header_size + (-header_size % 8)
+        for (name, typecode), length in zip(SHARED_NETWORK_SECTIONS, lengths):
+            n_bytes = length * array.array(typecode).itemsize
+            setattr(self, name, buf[position:position + n_bytes].cast(typecode))
+            position += n_bytes + (-n_bytes % 8)
+
+        self.n_users = self.n_base = n_users
+        self.delta = dict()  # nothing changed since the snapshot, for graph_search.BreadthFirstSearch
+        self.user_ids = None  # user id -> user index, built by user_index() when needed
+
+    def __len__(self):
+        return self.n_users
+
+    def __getitem__(self, user):
+        """
+        :param user: int, user's index
+        :return: memoryview, user's friends
+        """
+        return self.friends[self.offsets[user]:self.offsets[user + 1]]
+
+    def purchases(self, user):
+        """
+        :param user: int, user's index
+        :return: tuple, (log_entry_counter, amount) memoryviews of user's purchases, oldest first
+        """
+        start, end = self.purchase_offsets[user], self.purchase_offsets[user + 1]
+        return self.purchase_counters[start:end], self.purchase_amounts[start:end]
+
+    def user_name(self, user):
+        """
+        :param user: int, user's index
+        :return: str, user's id from the log
+        """
+        return bytes(self.names[self.name_offsets[user]:self.name_offsets[user + 1]]).decode('utf-8')
+
+    def user_index(self, user_id):
+        """
+        :param user_id: str, user's id from the log
+        :return: int, user's index, None if unknown
+        """
+        if self.user_ids is None:
+            self.user_ids = dict((self.user_name(user), user) for user in range(self.n_users))
+        return self.user_ids.get(user_id)
+
+    def close(self):
+        """
+        Release the views and unmap the file, views returned by the methods above must be released or deleted first
+
+        :return: void
+        """
+        for name, typecode in SHARED_NETWORK_SECTIONS:
+            getattr(self, name).release()
+        self.buf.release()
+        self.map.close()